@@ -3,6 +3,22 @@ import tempfile
 import os
 import re
 import json
+import sys
+import ast
+import builtins
+import importlib
+
+# video_generator lives at the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from video_generator import (RENDER_COST_MODEL_PATH, estimate_render_cost, find_scene_classes, get_shared_tex_cache,
+                             scene_strings, write_manim_config)
+
+# test_run_manim_code gives up after 60s, so don't start renders estimated to take longer
+MAX_ESTIMATED_RENDER_SECONDS = 60
+
+# The render_cost tier only runs with coefficients fitted by calibrate_render_cost (MANIM_RENDER_COST_MODEL;
+# the defaults are too rough to reject code on); estimates must exceed the limit by this factor to reject
+RENDER_COST_SAFETY_MARGIN = 2.0
 
 def validate_manim_code(code):
     """
@@ -29,10 +45,10 @@ def validate_manim_code(code):
     
     return True, ""
 
-def test_run_manim_code(code, class_name):
+def _run_manim(code, class_name, flags, timeout):
     """
-    Attempts to run the Manim code and generate a video.
-    Returns (success, output_path or error_message)
+    Runs the manim CLI on the code with the given flags.
+    Returns (success, CompletedProcess or error_message)
     """
     # Create a temporary file
     with tempfile.NamedTemporaryFile(suffix='.py', delete=False) as temp_file:
@@ -44,27 +60,191 @@ def test_run_manim_code(code, class_name):
         output_dir = os.path.join(os.getcwd(), "media", "videos")
         os.makedirs(output_dir, exist_ok=True)
         
-        cmd = ["manim", "-pql", temp_file_path, class_name]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+        # Share compiled LaTeX/Text SVGs with video_generator renders
+        with get_shared_tex_cache().scratch(scene_strings(code)) as tex_dirs:
+            config_file = write_manim_config(tex_dirs, f"{temp_file_path}.cfg")
+            try:
+                cmd = ["manim", *flags, "--config_file", config_file, temp_file_path, class_name]
+                result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+            finally:
+                os.unlink(config_file)
         
         if result.returncode != 0:
             return False, f"Manim execution failed: {result.stderr}"
-        
-        # Extract the output video path from stdout
-        video_path_match = re.search(r"File ready at '(.+?)'", result.stdout)
-        if video_path_match:
-            return True, video_path_match.group(1)
-        else:
-            return True, "Video generated but path not found in output"
+        return True, result
     
     except subprocess.TimeoutExpired:
-        return False, "Execution timed out (60s limit)"
+        return False, f"Execution timed out ({timeout}s limit)"
     except Exception as e:
         return False, f"Error running Manim: {str(e)}"
     finally:
         # Clean up the temporary file
         os.unlink(temp_file_path)
 
+def test_run_manim_code(code, class_name):
+    """
+    Attempts to run the Manim code and generate a video.
+    Returns (success, output_path or error_message)
+    """
+    success, result = _run_manim(code, class_name, ["-pql"], timeout=60)
+    if not success:
+        return False, result
+    
+    # Extract the output video path from stdout
+    video_path_match = re.search(r"File ready at '(.+?)'", result.stdout)
+    if video_path_match:
+        return True, video_path_match.group(1)
+    else:
+        return True, "Video generated but path not found in output"
+
+# Validation ladder, cheapest tier first. Each tier only runs if every earlier one passed.
+VALIDATION_TIERS = ["syntax", "structure", "names", "render_cost", "dry_run", "last_frame", "full_render"]
+
+def check_syntax(code, class_name=None):
+    """Tier 1: the code compiles."""
+    try:
+        compile(code, '<string>', 'exec')
+    except SyntaxError as e:
+        return False, f"Syntax error: {str(e)}"
+    return True, ""
+
+def check_structure(code, class_name=None):
+    """Tier 2: manim is imported and the scene class exists with a construct method."""
+    tree = ast.parse(code)
+    
+    imports_manim = any(
+        (isinstance(node, ast.ImportFrom) and (node.module or "").split(".")[0] == "manim")
+        or (isinstance(node, ast.Import) and any(alias.name.split(".")[0] == "manim" for alias in node.names))
+        for node in ast.walk(tree)
+    )
+    if not imports_manim:
+        return False, "Missing Manim imports"
+    
+    scene_classes = find_scene_classes(code)
+    if not scene_classes:
+        return False, "Animation class must inherit from Scene, MovingCameraScene, or ThreeDScene"
+    if class_name and class_name not in scene_classes:
+        return False, f"Scene class {class_name} not found (found: {', '.join(scene_classes)})"
+    
+    # construct may also be inherited from another scene in the file
+    has_construct = any(
+        isinstance(node, ast.ClassDef) and node.name in scene_classes
+        and any(isinstance(item, ast.FunctionDef) and item.name == "construct" for item in node.body)
+        for node in tree.body
+    )
+    if not has_construct:
+        return False, "Missing construct method"
+    
+    return True, ""
+
+_star_import_names = {}
+
+def _exported_names(module_name):
+    """Names a `from module import *` brings in, or None if the module can't be imported."""
+    if module_name not in _star_import_names:
+        try:
+            module = importlib.import_module(module_name)
+            _star_import_names[module_name] = set(getattr(module, "__all__", None) or dir(module))
+        except Exception:
+            _star_import_names[module_name] = None
+    return _star_import_names[module_name]
+
+def check_names(code, class_name=None):
+    """
+    Tier 3: every name the code reads is defined somewhere, imported, or a builtin.
+    Scoping is ignored (a name bound anywhere counts), so this only flags names
+    that can't resolve at all, like misspelled or hallucinated manim classes.
+    """
+    tree = ast.parse(code)
+    
+    defined = set(dir(builtins))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            defined.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            defined.add(node.name)
+        elif isinstance(node, ast.arg):
+            defined.add(node.arg)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            defined.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            defined.update(node.names)
+        elif isinstance(node, ast.Import):
+            defined.update(alias.asname or alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            for alias in node.names:
+                if alias.name != "*":
+                    defined.add(alias.asname or alias.name)
+                    continue
+                exported = _exported_names(node.module)
+                if exported is None:
+                    return True, f"Skipped: can't resolve names from `from {node.module} import *`"
+                defined.update(exported)
+    
+    undefined = sorted({
+        node.id for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id not in defined
+    })
+    if undefined:
+        return False, f"Undefined names: {', '.join(undefined)}"
+    return True, ""
+
+def check_render_cost(code, class_name=None):
+    """
+    Tier 4: the scene isn't estimated to blow the render timeout (test runs use -ql).
+    Skipped unless RENDER_COST_MODEL_PATH points at a calibrated cost model.
+    """
+    if not RENDER_COST_MODEL_PATH or not os.path.exists(RENDER_COST_MODEL_PATH):
+        return True, "Skipped: no calibrated render cost model (set MANIM_RENDER_COST_MODEL)"
+    
+    try:
+        estimate = estimate_render_cost(code, class_name, quality="l")
+    except Exception as e:
+        return False, f"Render cost estimate failed: {str(e)}"
+    
+    limit = MAX_ESTIMATED_RENDER_SECONDS * RENDER_COST_SAFETY_MARGIN
+    if estimate and estimate["seconds"] > limit:
+        return False, f"Estimated render time {estimate['seconds']:.0f}s exceeds {limit:.0f}s limit"
+    return True, ""
+
+def check_dry_run(code, class_name):
+    """Tier 5: construct() runs end to end without writing any frames."""
+    success, result = _run_manim(code, class_name, ["--dry_run"], timeout=30)
+    return (True, "") if success else (False, result)
+
+def check_last_frame(code, class_name):
+    """Tier 6: the final frame renders (animations are skipped, only one image is written)."""
+    success, result = _run_manim(code, class_name, ["-ql", "-s"], timeout=30)
+    return (True, "") if success else (False, result)
+
+VALIDATION_CHECKS = {
+    "syntax": check_syntax,
+    "structure": check_structure,
+    "names": check_names,
+    "render_cost": check_render_cost,
+    "dry_run": check_dry_run,
+    "last_frame": check_last_frame,
+    "full_render": test_run_manim_code,
+}
+
+def validate_manim_code_tiered(code, class_name=None, max_tier="full_render"):
+    """
+    Runs the validation ladder up to and including max_tier, stopping at the first failure.
+    Returns (is_valid, tier, message): the failing tier and its error, or max_tier and
+    its output (the video path for full_render).
+    """
+    message = ""
+    for tier in VALIDATION_TIERS[:VALIDATION_TIERS.index(max_tier) + 1]:
+        if class_name is None and tier == "dry_run":
+            # Execution tiers need a scene; default to the first one
+            class_name = find_scene_classes(code)[0]
+        
+        is_valid, message = VALIDATION_CHECKS[tier](code, class_name)
+        if not is_valid:
+            return False, tier, message
+    
+    return True, max_tier, message
+
 # Example usage for validating synthetic examples
 def validate_synthetic_dataset():
     with open("3b1b/dataset/data/synthetic_manim_dataset.json", "r") as f:
@@ -79,21 +259,14 @@ def validate_synthetic_dataset():
         
         print(f"Validating example {i+1}/{len(synthetic_examples)}: {class_name}")
         
-        # First check syntax and structure
-        is_valid, error_message = validate_manim_code(code)
-        if not is_valid:
-            print(f"  Failed validation: {error_message}")
-            invalid_examples.append((example, error_message))
-            continue
-        
-        # Then try to run it
-        success, result = test_run_manim_code(code, class_name)
+        # Climb the validation ladder; most broken examples fail in the static tiers
+        success, tier, result = validate_manim_code_tiered(code, class_name)
         if success:
             print(f"  Success! Video generated at: {result}")
             example["video_path"] = result
             valid_examples.append(example)
         else:
-            print(f"  Failed execution: {result}")
+            print(f"  Failed {tier}: {result}")
             invalid_examples.append((example, result))
     
     # Save validated examples
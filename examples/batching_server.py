@@ -0,0 +1,247 @@
+# Dynamic micro-batching server around the local model in huggingface.py.
+#
+# Concurrent requests are collected for a few milliseconds, left-padded into a
+# single model.generate call and split back per request. The server speaks the
+# OpenAI /v1/chat/completions protocol, so inference.py can point at it:
+#
+#   MANIM_MODEL_ID=hf-internal-testing/tiny-random-Qwen2ForCausalLM python examples/batching_server.py --port 8080
+#   HUGGINGFACE_BASE_URL=http://localhost:8080/v1 python inference.py
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+
+class _GenerationRequest:
+    def __init__(self, messages, max_new_tokens, temperature, top_p, continue_final_message=False):
+        self.messages = messages
+        self.continue_final_message = continue_final_message
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.future = Future()
+
+    @property
+    def sampling_key(self):
+        # Requests can only share a generate call if they sample the same way
+        return (self.temperature, self.top_p)
+
+class BatchingEngine:
+    """
+    Runs concurrent generation requests as batched model.generate calls.
+
+    A background thread waits for a request, keeps collecting more for up to
+    `batch_window` seconds (or until `max_batch_size`), then generates for the
+    whole batch at once. Requests with different sampling settings go in
+    separate generate calls.
+    """
+
+    def __init__(self, model, tokenizer, build_prompt, max_batch_size=8, batch_window=0.02):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.build_prompt = build_prompt
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+
+        # Decoder-only models need left padding so every prompt ends right where generation starts
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        self.batches_run = 0
+        self.requests_served = 0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="batching-engine", daemon=True)
+        self._worker.start()
+
+    def submit(self, messages, max_new_tokens=512, temperature=0.7, top_p=0.9,
+               continue_final_message=False) -> Future:
+        """Queue a request; the returned Future resolves to a result dict (see generate)."""
+        request = _GenerationRequest(messages, max_new_tokens, temperature, top_p, continue_final_message)
+        self._queue.put(request)
+        return request.future
+
+    def generate(self, messages, max_new_tokens=512, temperature=0.7, top_p=0.9, continue_final_message=False):
+        """
+        Generate a reply, batched with whatever else is in flight. With continue_final_message,
+        the last (assistant) message is continued instead of starting a new turn.
+        Returns {"text", "prompt_tokens", "completion_tokens", "finish_reason"}.
+        """
+        return self.submit(messages, max_new_tokens, temperature, top_p, continue_final_message).result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            groups = {}
+            for request in batch:
+                groups.setdefault(request.sampling_key, []).append(request)
+            for requests in groups.values():
+                try:
+                    self._generate_batch(requests)
+                except Exception as e:
+                    for request in requests:
+                        request.future.set_exception(e)
+
+    def _generate_batch(self, requests):
+        prompts = [self.build_prompt(request.messages, request.continue_final_message) for request in requests]
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.model.device)
+        prompt_length = inputs.input_ids.shape[1]
+
+        temperature, top_p = requests[0].sampling_key
+        do_sample = temperature is not None and temperature > 0
+        sampling = {"temperature": temperature, "top_p": top_p} if do_sample else {}
+
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max(request.max_new_tokens for request in requests),
+                do_sample=do_sample,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **sampling
+            )
+
+        self.batches_run += 1
+        for i, request in enumerate(requests):
+            # Trim each row to its own token budget and first end-of-sequence
+            tokens = outputs[i, prompt_length:prompt_length + request.max_new_tokens].tolist()
+            finish_reason = "length"
+            if self.tokenizer.eos_token_id in tokens:
+                tokens = tokens[:tokens.index(self.tokenizer.eos_token_id)]
+                finish_reason = "stop"
+
+            self.requests_served += 1
+            request.future.set_result({
+                "text": self.tokenizer.decode(tokens, skip_special_tokens=True),
+                "prompt_tokens": int(inputs.attention_mask[i].sum()),
+                "completion_tokens": len(tokens),
+                "finish_reason": finish_reason
+            })
+
+def make_handler(engine, model_name):
+    """Build an OpenAI-compatible request handler bound to `engine`."""
+
+    class ChatCompletionsHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/v1/models":
+                self._send_json(200, {"object": "list", "data": [{"id": model_name, "object": "model"}]})
+            elif self.path.rstrip("/") == "/health":
+                self._send_json(200, {"status": "ok", "batches_run": engine.batches_run,
+                                      "requests_served": engine.requests_served})
+            else:
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/v1/chat/completions":
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                result = engine.generate(
+                    request["messages"],
+                    max_new_tokens=request.get("max_tokens") or 512,
+                    temperature=request.get("temperature", 0.7),
+                    top_p=request.get("top_p", 0.9),
+                    continue_final_message=bool(request.get("continue_final_message"))
+                )
+            except (KeyError, ValueError) as e:
+                self._send_json(400, {"error": {"message": f"Bad request: {e}"}})
+                return
+            except Exception as e:
+                self._send_json(500, {"error": {"message": str(e)}})
+                return
+
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            created = int(time.time())
+            usage = {
+                "prompt_tokens": result["prompt_tokens"],
+                "completion_tokens": result["completion_tokens"],
+                "total_tokens": result["prompt_tokens"] + result["completion_tokens"]
+            }
+
+            if not request.get("stream"):
+                self._send_json(200, {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model_name,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": result["text"]},
+                        "finish_reason": result["finish_reason"]
+                    }],
+                    "usage": usage
+                })
+                return
+
+            # Batched generation finishes all at once, so the stream is one content chunk plus the finish chunk
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            chunks = [
+                {"index": 0, "delta": {"role": "assistant", "content": result["text"]}, "finish_reason": None},
+                {"index": 0, "delta": {}, "finish_reason": result["finish_reason"]},
+            ]
+            for choice in chunks:
+                event = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                         "model": model_name, "choices": [choice]}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+    return ChatCompletionsHandler
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible micro-batching server for the Manim model")
+    parser.add_argument("--model", help="Model id or path (defaults to MANIM_MODEL_ID / the fine-tuned model)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--batch-window-ms", type=float, default=20.0,
+                        help="How long to wait for more requests before generating")
+    parser.add_argument("--warm-up", action="store_true", help="Run a tiny generation before accepting requests")
+    args = parser.parse_args()
+
+    if args.model:
+        os.environ["MANIM_MODEL_ID"] = args.model
+    import huggingface
+    huggingface.load(warm_up_model=args.warm_up)
+
+    engine = BatchingEngine(
+        huggingface.model, huggingface.tokenizer, huggingface.build_prompt,
+        max_batch_size=args.max_batch_size, batch_window=args.batch_window_ms / 1000
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(engine, huggingface.MODEL_ID))
+    print(f"Serving {huggingface.MODEL_ID} on http://{args.host}:{args.port}/v1/chat/completions")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
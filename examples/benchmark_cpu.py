@@ -0,0 +1,107 @@
+# Benchmark the CPU backends in huggingface.py: tokens/sec and peak RSS per configuration.
+#
+# Each configuration runs in its own subprocess, since thread pools can only be
+# configured once per process and peak RSS never goes down.
+#
+#   MANIM_MODEL_ID=Qwen/Qwen3-0.6B python examples/benchmark_cpu.py --dtypes fp32 bf16 int8 --threads 4 8 --compile
+import argparse
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+BENCHMARK_MESSAGES = [
+    {"role": "user", "content": "Write a Manim scene that animates the formula e^{i\\pi} + 1 = 0."}
+]
+
+def run_single(args):
+    """Load the configuration given by the MANIM_CPU_* variables, generate a fixed number of tokens and print the result as JSON."""
+    load_start = time.perf_counter()
+    import torch
+    import huggingface
+    model = huggingface.model
+    load_seconds = time.perf_counter() - load_start
+
+    tokenizer = huggingface.tokenizer
+    inputs = tokenizer(huggingface.build_prompt(BENCHMARK_MESSAGES), return_tensors="pt")
+
+    def generate(max_new_tokens):
+        with torch.no_grad():
+            # Greedy with min_new_tokens so every configuration decodes exactly the same number of tokens
+            return model.generate(
+                **inputs, max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens,
+                do_sample=False, pad_token_id=tokenizer.eos_token_id
+            )
+
+    # Warm-up run (triggers torch.compile, allocator growth, oneDNN kernel selection)
+    generate(8)
+
+    start = time.perf_counter()
+    outputs = generate(args.tokens)
+    seconds = time.perf_counter() - start
+    new_tokens = outputs.shape[1] - inputs.input_ids.shape[1]
+
+    print(json.dumps({
+        # load_model may fall back from the requested dtype (e.g. bf16 without hardware support)
+        "dtype": model.loaded_dtype,
+        "requested_dtype": os.environ["MANIM_CPU_DTYPE"],
+        "threads": torch.get_num_threads(),
+        "interop_threads": torch.get_num_interop_threads(),
+        "compile": os.environ["MANIM_TORCH_COMPILE"] == "1",
+        "load_seconds": round(load_seconds, 2),
+        "tokens": int(new_tokens),
+        "tokens_per_second": round(new_tokens / seconds, 2),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }))
+
+def run_all(args):
+    """Run every combination of the requested settings and print a summary table."""
+    results = []
+    for dtype, threads, compile_model in itertools.product(args.dtypes, args.threads, [False, True] if args.compile else [False]):
+        command = [sys.executable, os.path.abspath(__file__), "--single", "--tokens", str(args.tokens)]
+        env = dict(os.environ, MANIM_CPU_DTYPE=dtype, MANIM_CPU_THREADS=str(threads),
+                   MANIM_CPU_INTEROP_THREADS=str(args.interop_threads), MANIM_TORCH_COMPILE="1" if compile_model else "0")
+
+        label = f"{dtype}, {threads or 'default'} threads{', compiled' if compile_model else ''}"
+        print(f"Running {label}...")
+        process = subprocess.run(command, capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if process.returncode != 0:
+            print(f"  failed: {process.stderr.strip().splitlines()[-1] if process.stderr.strip() else process.returncode}")
+            continue
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        print(f"  {result['tokens_per_second']} tokens/s, peak RSS {result['peak_rss_mb']} MB")
+        results.append(result)
+
+    if results:
+        print(f"\n{'dtype':<6} {'threads':>7} {'compile':>7} {'load s':>7} {'tok/s':>8} {'peak RSS MB':>12}")
+        for result in sorted(results, key=lambda r: -r["tokens_per_second"]):
+            print(f"{result['dtype']:<6} {result['threads']:>7} {str(result['compile']):>7} "
+                  f"{result['load_seconds']:>7} {result['tokens_per_second']:>8} {result['peak_rss_mb']:>12}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CPU inference configurations")
+    parser.add_argument("--dtypes", nargs="+", default=["fp32", "bf16", "int8"])
+    parser.add_argument("--threads", nargs="+", type=int, default=[0], help="Intra-op thread counts to try (0 = torch default)")
+    parser.add_argument("--interop-threads", type=int, default=1)
+    parser.add_argument("--compile", action="store_true", help="Also try each configuration with torch.compile")
+    parser.add_argument("--tokens", type=int, default=128, help="Tokens to generate per run")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    # Internal: run one configuration in this process
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        run_single(args)
+    else:
+        run_all(args)
+
+if __name__ == '__main__':
+    main()
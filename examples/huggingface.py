@@ -1,19 +1,201 @@
 # Load model directly
-from transformers import AutoTokenizer, AutoModelForCausalLM
-import torch
+# torch and transformers are imported on first use, so importing this module is
+# cheap; the tokenizer and model load lazily on first use (or via load()).
+import importlib.util
+import os
+import threading
+import time
 
-tokenizer = AutoTokenizer.from_pretrained("haidangung/qwen3-manim-16bit")
-model = AutoModelForCausalLM.from_pretrained(
-    "haidangung/qwen3-manim-16bit",
-    torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32, # Use float16 if CUDA is available
-    device_map="auto" if torch.cuda.is_available() else None # Automatically map to GPU if available
-)
+# Override with MANIM_MODEL_ID, e.g. a tiny checkpoint for CPU testing
+MODEL_ID = os.getenv("MANIM_MODEL_ID", "haidangung/qwen3-manim-16bit")
 
-def generate_response(messages, max_new_tokens=512):
-    # Apply chat template
+# CPU backend settings (ignored when CUDA is available):
+#   MANIM_CPU_DTYPE          "fp32" (default), "bf16" or "int8" (dynamic quantization of linear layers)
+#   MANIM_CPU_THREADS        intra-op threads, e.g. the number of physical cores
+#   MANIM_CPU_INTEROP_THREADS inter-op threads
+#   MANIM_TORCH_COMPILE      set to 1 to torch.compile the forward pass
+CPU_DTYPES = ("fp32", "bf16", "int8")
+
+# Speculative (assisted) decoding: a small draft model from the same tokenizer
+# family proposes tokens that the main model verifies in one forward pass.
+#   MANIM_DRAFT_MODEL_ID     e.g. "Qwen/Qwen3-0.6B"; unset disables speculative decoding
+#   MANIM_DRAFT_TOKENS       tokens the draft proposes per step (default 5)
+DRAFT_MODEL_ID = os.getenv("MANIM_DRAFT_MODEL_ID")
+DEFAULT_DRAFT_TOKENS = int(os.getenv("MANIM_DRAFT_TOKENS", "5"))
+
+def cpu_supports_bf16():
+    """True if oneDNN has fast bf16 kernels on this CPU (AVX512-BF16 / AMX)."""
+    import torch
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+def configure_cpu_threads(threads=None, interop_threads=None):
+    """Set the intra-op and inter-op thread pools (must run before any parallel work for inter-op)."""
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            print(f"Could not set inter-op threads: {e}")
+
+def load_model(model_id=MODEL_ID, cpu_dtype=None, threads=None, interop_threads=None, compile_model=None):
+    """
+    Load the model for this machine: float16 on GPU, or the configured CPU backend.
+
+    Args:
+        model_id (str): Hugging Face model id or local path
+        cpu_dtype (str): One of CPU_DTYPES (defaults to MANIM_CPU_DTYPE or "fp32")
+        threads (int): Intra-op threads (defaults to MANIM_CPU_THREADS)
+        interop_threads (int): Inter-op threads (defaults to MANIM_CPU_INTEROP_THREADS)
+        compile_model (bool): torch.compile the forward pass (defaults to MANIM_TORCH_COMPILE)
+
+    Returns:
+        The loaded model in eval mode, with the dtype actually used in `loaded_dtype`
+        ("fp16" on GPU, otherwise one of CPU_DTYPES)
+    """
+    import torch
+    from transformers import AutoModelForCausalLM
+
+    # Safetensors files (memory-mapped) are preferred when the checkpoint has them,
+    # with .bin-only checkpoints still loading
+    load_kwargs = {"use_safetensors": None}
+    if importlib.util.find_spec("accelerate") is not None:
+        # Weights are copied straight into the model instead of first building randomly
+        # initialized ones (many transformers versions need accelerate for this)
+        load_kwargs["low_cpu_mem_usage"] = True
+
+    if torch.cuda.is_available():
+        gpu_model = AutoModelForCausalLM.from_pretrained(
+            model_id,
+            torch_dtype=torch.float16, # Use float16 if CUDA is available
+            device_map="auto", # Automatically map to GPU if available
+            **load_kwargs
+        )
+        gpu_model.loaded_dtype = "fp16"
+        return gpu_model
+
+    cpu_dtype = cpu_dtype or os.getenv("MANIM_CPU_DTYPE", "fp32")
+    if cpu_dtype not in CPU_DTYPES:
+        raise ValueError(f"Unknown CPU dtype {cpu_dtype!r}, expected one of {CPU_DTYPES}")
+    if cpu_dtype == "bf16" and not cpu_supports_bf16():
+        print("bf16 is not accelerated on this CPU, falling back to fp32")
+        cpu_dtype = "fp32"
+    if compile_model is None:
+        compile_model = os.getenv("MANIM_TORCH_COMPILE", "0") == "1"
+
+    configure_cpu_threads(
+        threads or int(os.getenv("MANIM_CPU_THREADS", "0")),
+        interop_threads or int(os.getenv("MANIM_CPU_INTEROP_THREADS", "0"))
+    )
+
+    cpu_model = AutoModelForCausalLM.from_pretrained(
+        model_id,
+        torch_dtype=torch.bfloat16 if cpu_dtype == "bf16" else torch.float32,
+        **load_kwargs
+    )
+    cpu_model.eval()
+    if cpu_dtype == "int8":
+        # Weights stored as int8, activations quantized on the fly; only nn.Linear is converted
+        # In place, so the fp32 weights aren't copied first (which would double the load's peak memory)
+        cpu_model = torch.ao.quantization.quantize_dynamic(cpu_model, {torch.nn.Linear}, dtype=torch.qint8,
+                                                           inplace=True)
+    if compile_model:
+        # Shapes change every decoding step, so compile for dynamic shapes to avoid recompiling
+        cpu_model.forward = torch.compile(cpu_model.forward, dynamic=True)
+    cpu_model.loaded_dtype = cpu_dtype
+    return cpu_model
+
+_tokenizer = None
+_model = None
+_warmed_up = False
+_draft_models = {}
+_load_lock = threading.Lock()
+
+def get_tokenizer():
+    """Return the shared tokenizer, loading it on first use."""
+    global _tokenizer
+    if _tokenizer is None:
+        with _load_lock:
+            if _tokenizer is None:
+                from transformers import AutoTokenizer
+                _tokenizer = AutoTokenizer.from_pretrained(MODEL_ID)
+    return _tokenizer
+
+def get_model():
+    """Return the shared model, loading it on first use."""
+    global _model
+    if _model is None:
+        with _load_lock:
+            if _model is None:
+                start = time.perf_counter()
+                _model = load_model()
+                print(f"Loaded {MODEL_ID} in {time.perf_counter() - start:.1f}s")
+    return _model
+
+def get_draft_model(draft_model_id=None):
+    """Return the draft model for speculative decoding (loaded once per id), or None if none is configured."""
+    draft_model_id = draft_model_id or DRAFT_MODEL_ID
+    if not draft_model_id:
+        return None
+    if draft_model_id not in _draft_models:
+        with _load_lock:
+            if draft_model_id not in _draft_models:
+                # Same backend as the main model (fp16 on GPU, MANIM_CPU_* settings on CPU)
+                _draft_models[draft_model_id] = load_model(draft_model_id)
+    return _draft_models[draft_model_id]
+
+def _count_forward_passes(module):
+    """Attach a forward hook counting calls to `module`; returns (counter, hook handle)."""
+    counter = {"calls": 0}
+
+    def hook(*args):
+        counter["calls"] += 1
+
+    return counter, module.register_forward_hook(hook)
+
+def warm_up(max_new_tokens=4):
+    """Run a tiny generation so first-request costs (kernel selection, torch.compile, allocator growth) are paid up front."""
+    global _warmed_up
+    generate_response([{"role": "user", "content": "Hello"}], max_new_tokens=max_new_tokens)
+    _warmed_up = True
+
+def load(warm_up_model=False):
+    """Load the tokenizer and model now, optionally followed by a warm-up generation."""
+    get_tokenizer()
+    get_model()
+    if warm_up_model:
+        warm_up()
+
+def is_ready(require_warm_up=False):
+    """Readiness check: True once the model is loaded (and warmed up, if required). Never triggers a load."""
+    return _tokenizer is not None and _model is not None and (_warmed_up or not require_warm_up)
+
+def __getattr__(name):
+    # Keep `huggingface.model` / `huggingface.tokenizer` working, loading on first access
+    if name == "model":
+        return get_model()
+    if name == "tokenizer":
+        return get_tokenizer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def build_prompt(messages, continue_final_message=False):
     # The Qwen3 notebook (lines 1471-1476) uses apply_chat_template
     # It's good practice to check if it exists, similar to test/huggingface_test.py (lines 15-22)
-    if hasattr(tokenizer, 'apply_chat_template'):
+    # (tiny test checkpoints have the method but no template, so check for the template itself)
+    # With continue_final_message, the last (assistant) message is left open for the model to continue
+    tokenizer = get_tokenizer()
+    if getattr(tokenizer, 'chat_template', None):
+        if continue_final_message:
+            return tokenizer.apply_chat_template(
+                messages,
+                tokenize=False,
+                add_generation_prompt=False,
+                continue_final_message=True
+            )
         prompt = tokenizer.apply_chat_template(
             messages,
             tokenize=False,
@@ -22,9 +204,39 @@ def generate_response(messages, max_new_tokens=512):
     else:
         # Fallback for models without a chat template
         prompt = ""
-        for message in messages:
+        history = messages[:-1] if continue_final_message else messages
+        for message in history:
             prompt += f"{message['role']}: {message['content']}\n"
         prompt += "assistant: " # Or the appropriate turn indicator for your model
+        if continue_final_message:
+            prompt += messages[-1]['content']
+    return prompt
+
+def generate_response(messages, max_new_tokens=512, draft_model_id=None, num_assistant_tokens=None,
+                      return_stats=False):
+    """
+    Generate a reply to a chat history.
+
+    Args:
+        messages (list): Chat messages ({"role", "content"} dicts)
+        max_new_tokens (int): Maximum tokens to generate
+        draft_model_id (str): Draft model for speculative decoding (defaults to MANIM_DRAFT_MODEL_ID;
+            no speculative decoding if neither is set)
+        num_assistant_tokens (int): Tokens the draft proposes per step (defaults to MANIM_DRAFT_TOKENS)
+        return_stats (bool): Also return generation statistics
+
+    Returns:
+        str: The reply, or (reply, stats) if return_stats is set. stats has new_tokens, seconds and
+            tokens_per_second, plus with a draft model: target_forward_passes, draft_tokens,
+            accepted_tokens, acceptance_rate and tokens_per_step
+    """
+    import torch
+    tokenizer = get_tokenizer()
+    model = get_model()
+    draft_model = get_draft_model(draft_model_id)
+
+    # Apply chat template
+    prompt = build_prompt(messages)
 
     # Tokenize the prompt
     inputs = tokenizer(prompt, return_tensors="pt")
@@ -36,20 +248,157 @@ def generate_response(messages, max_new_tokens=512):
     # Generate response
     # Generation parameters can be tuned, see test/test.py (lines 91-99)
     # or the Qwen3 notebook (lines 1479-1484)
-    with torch.no_grad(): # Important for inference to save memory and compute
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=max_new_tokens,
-            temperature=0.7,       # Controls randomness. Lower is more deterministic.
-            top_p=0.9,             # Nucleus sampling: considers the smallest set of tokens whose cumulative probability exceeds top_p.
-            do_sample=True,        # Whether to use sampling; must be True for temperature and top_p to have an effect.
-            pad_token_id=tokenizer.eos_token_id # Set pad_token_id to eos_token_id for open-end generation
-        )
+    assisted = {}
+    if draft_model is not None:
+        # A fixed lookahead; the default "heuristic" schedule would keep changing it between calls
+        draft_model.generation_config.num_assistant_tokens = num_assistant_tokens or DEFAULT_DRAFT_TOKENS
+        draft_model.generation_config.num_assistant_tokens_schedule = "constant"
+        assisted["assistant_model"] = draft_model
+        # Every draft forward pass proposes one token; every target pass verifies a batch of them
+        target_passes, target_hook = _count_forward_passes(model)
+        draft_passes, draft_hook = _count_forward_passes(draft_model)
+
+    start = time.perf_counter()
+    try:
+        with torch.no_grad(): # Important for inference to save memory and compute
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                temperature=0.7,       # Controls randomness. Lower is more deterministic.
+                top_p=0.9,             # Nucleus sampling: considers the smallest set of tokens whose cumulative probability exceeds top_p.
+                do_sample=True,        # Whether to use sampling; must be True for temperature and top_p to have an effect.
+                pad_token_id=tokenizer.eos_token_id, # Set pad_token_id to eos_token_id for open-end generation
+                **assisted
+            )
+    finally:
+        if assisted:
+            target_hook.remove()
+            draft_hook.remove()
+    seconds = time.perf_counter() - start
 
     # Decode the generated tokens
     # The slicing removes the input prompt from the generated output.
-    response_text = tokenizer.decode(outputs[0][inputs.input_ids.shape[1]:], skip_special_tokens=True)
-    return response_text
+    new_tokens = outputs[0][inputs.input_ids.shape[1]:]
+    response_text = tokenizer.decode(new_tokens, skip_special_tokens=True)
+    if not return_stats:
+        return response_text
+
+    stats = {"new_tokens": len(new_tokens), "seconds": seconds,
+             "tokens_per_second": len(new_tokens) / seconds if seconds else 0.0}
+    if assisted:
+        # Each verification step yields the accepted draft tokens plus one token from the target model
+        accepted = max(len(new_tokens) - target_passes["calls"], 0)
+        stats.update({
+            "target_forward_passes": target_passes["calls"],
+            "draft_tokens": draft_passes["calls"],
+            "accepted_tokens": accepted,
+            "acceptance_rate": accepted / draft_passes["calls"] if draft_passes["calls"] else 0.0,
+            "tokens_per_step": len(new_tokens) / target_passes["calls"] if target_passes["calls"] else 0.0
+        })
+    return response_text, stats
+
+class ChatSession:
+    """
+    Multi-turn chat that keeps the KV cache between turns.
+
+    When a turn only appends messages to the previous one (which ended with the
+    reply this session returned), the new input is the cached token sequence plus
+    the templated tokens of the appended messages, so a follow-up only prefills
+    the new message. Re-applying the template to the whole history would not
+    match the cache: Qwen3's template drops <think> blocks from earlier replies.
+    If the history was edited instead, the full templated prompt is used and the
+    cache is cropped back to where it diverges (a full prefill if nothing matches).
+    """
+
+    # Stands in for the history when templating appended messages on their own
+    _TEMPLATE_ANCHOR = [{"role": "system", "content": "."}]
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Drop the cached conversation."""
+        self.past_key_values = None
+        self.messages = []  # The conversation so far, ending with the last reply
+        self.sequence = []  # Its tokens, including the last sampled token
+        self.token_ids = []  # Tokens whose keys/values are in past_key_values
+        self.reused_tokens = 0
+        self.prefilled_tokens = 0
+
+    def _appended_ids(self, messages):
+        """
+        Token ids for the conversation as the cached sequence plus the templated tokens of the
+        messages appended since the last turn, or None if the history changed.
+        """
+        tokenizer = get_tokenizer()
+        if (not self.sequence or len(messages) <= len(self.messages)
+                or messages[:len(self.messages)] != self.messages
+                or not getattr(tokenizer, "chat_template", None)):
+            return None
+
+        anchor = tokenizer.apply_chat_template(self._TEMPLATE_ANCHOR, tokenize=False)
+        templated = tokenizer.apply_chat_template(
+            self._TEMPLATE_ANCHOR + messages[len(self.messages):], tokenize=False, add_generation_prompt=True
+        )
+        eos = tokenizer.eos_token
+        if not templated.startswith(anchor) or not eos or eos not in anchor:
+            return None
+
+        # Whatever the template puts between one turn's end-of-turn token and the next turn (a newline for ChatML)
+        separator = anchor[anchor.rindex(eos) + len(eos):]
+        if self.sequence[-1] != tokenizer.eos_token_id:
+            # The last reply hit max_new_tokens, so close its turn first
+            separator = eos + separator
+        delta = separator + templated[len(anchor):]
+        return self.sequence + tokenizer(delta, add_special_tokens=False).input_ids
+
+    def generate(self, messages, max_new_tokens=512):
+        """Same as generate_response, reusing the cache from the previous turn."""
+        import torch
+        from transformers import DynamicCache
+        tokenizer = get_tokenizer()
+        model = get_model()
+
+        prompt_ids = self._appended_ids(messages)
+        if prompt_ids is None:
+            prompt_ids = tokenizer(build_prompt(messages)).input_ids
+        input_ids = torch.tensor([prompt_ids], device=model.device)
+
+        # Longest common prefix with what is already cached; at least one token must be prefilled
+        reuse = 0
+        limit = min(len(self.token_ids), len(prompt_ids) - 1)
+        while reuse < limit and self.token_ids[reuse] == prompt_ids[reuse]:
+            reuse += 1
+
+        if self.past_key_values is not None and reuse > 0:
+            self.past_key_values.crop(reuse)
+        else:
+            reuse = 0
+            self.past_key_values = DynamicCache()
+        self.reused_tokens = reuse
+        self.prefilled_tokens = len(prompt_ids) - reuse
+
+        # generate() skips the input ids already covered by past_key_values
+        with torch.no_grad():
+            outputs = model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=self.past_key_values,
+                max_new_tokens=max_new_tokens,
+                temperature=0.7,
+                top_p=0.9,
+                do_sample=True,
+                pad_token_id=tokenizer.eos_token_id,
+                return_dict_in_generate=True
+            )
+
+        # The last sampled token is never fed back, so the cache ends one token short of the sequence
+        self.past_key_values = outputs.past_key_values
+        self.sequence = outputs.sequences[0].tolist()
+        self.token_ids = self.sequence[:self.past_key_values.get_seq_length()]
+        reply = tokenizer.decode(self.sequence[len(prompt_ids):], skip_special_tokens=True)
+        self.messages = list(messages) + [{"role": "assistant", "content": reply}]
+        return reply
 
 if __name__ == '__main__':
     # Example usage:
@@ -58,8 +407,11 @@ if __name__ == '__main__':
         {"role": "user", "content": user_prompt}
     ]
 
+    # A session keeps the KV cache, so the follow-up only prefills the new turn
+    session = ChatSession()
+
     print(f"User: {user_prompt}")
-    assistant_response = generate_response(messages)
+    assistant_response = session.generate(messages)
     print(f"Assistant: {assistant_response}")
 
     # Example of a follow-up
@@ -68,6 +420,13 @@ if __name__ == '__main__':
     messages.append({"role": "user", "content": follow_up_prompt})
 
     print(f"\nUser: {follow_up_prompt}")
-    assistant_response_2 = generate_response(messages)
+    assistant_response_2 = session.generate(messages)
     print(f"Assistant: {assistant_response_2}")
+    print(f"(reused {session.reused_tokens} cached tokens, prefilled {session.prefilled_tokens})")
+
 
+    if DRAFT_MODEL_ID:
+        # Speculative decoding with the configured draft model
+        _, stats = generate_response(messages[:1], return_stats=True)
+        print(f"\nSpeculative decoding with {DRAFT_MODEL_ID}: {stats['tokens_per_second']:.1f} tokens/s, "
+              f"{stats['acceptance_rate']:.0%} of draft tokens accepted, {stats['tokens_per_step']:.2f} tokens per step")
@@ -1,56 +1,536 @@
-from openai import OpenAI
+import asyncio
+import json
 import os
+import re
+import time
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, List, Tuple
+
+import httpx
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
-from video_generator import generate_video_from_code
+from response_cache import ResponseCache
+from video_generator import clean_manim_code, generate_video_from_code
 
 # Load environment variables from .env file
 load_dotenv('.env.local')
 
-# Initialize the OpenAI client with the Hugging Face endpoint
-client = OpenAI(
-    base_url=os.getenv('HUGGINGFACE_BASE_URL'),
-    api_key=os.getenv('HUGGINGFACE_API_KEY')
-)
+# How the model's <think> reasoning is handled:
+#   "full"   - let the model think as long as it wants
+#   "capped" - force </think> once thinking_budget tokens have been spent thinking
+#   "off"    - disable thinking in the chat template
+THINKING_MODES = ("full", "capped", "off")
+DEFAULT_THINKING_BUDGET = 1024
 
-def generate_animation_code(prompt):
-    print(f"Sending prompt: {prompt}")
+# JSON-lines file that every request's latency record is appended to (unset disables logging)
+DEFAULT_METRICS_LOG = os.getenv("INFERENCE_METRICS_LOG")
+
+def _percentile(values: List[float], q: float) -> float:
+    """Linear-interpolated percentile of a non-empty list, q in [0, 100]."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def summarize_stream_timing(start: float, chunk_times: List[Tuple[float, bool]]) -> Dict:
+    """
+    Turn per-chunk arrival times into latency metrics.
+
+    Args:
+        start (float): time.perf_counter() when the request was sent
+        chunk_times (List[Tuple[float, bool]]): (arrival time, was a thinking token) per streamed chunk
+
+    Returns:
+        Dict: ttft_seconds, total_seconds, total_tokens, tokens_per_second (end to end),
+            decode_tokens_per_second (after the first token), inter_token_latency percentiles,
+            and the seconds and share of time spent thinking versus writing code
+    """
+    if not chunk_times:
+        return {"ttft_seconds": None, "total_seconds": None, "total_tokens": 0, "tokens_per_second": None,
+                "decode_tokens_per_second": None, "inter_token_latency": None,
+                "thinking_seconds": 0.0, "code_seconds": 0.0, "thinking_time_share": None}
+
+    arrivals = [arrival for arrival, _ in chunk_times]
+    total_seconds = arrivals[-1] - start
+    gaps = [later - earlier for earlier, later in zip(arrivals, arrivals[1:])]
+
+    # Each chunk is charged the wait since the previous one (the first one the time to first token)
+    thinking_seconds = code_seconds = 0.0
+    previous = start
+    for arrival, thinking in chunk_times:
+        if thinking:
+            thinking_seconds += arrival - previous
+        else:
+            code_seconds += arrival - previous
+        previous = arrival
+
+    return {
+        "ttft_seconds": arrivals[0] - start,
+        "total_seconds": total_seconds,
+        "total_tokens": len(chunk_times),
+        "tokens_per_second": len(chunk_times) / total_seconds if total_seconds > 0 else None,
+        "decode_tokens_per_second": len(gaps) / sum(gaps) if gaps and sum(gaps) > 0 else None,
+        "inter_token_latency": {
+            "p50": _percentile(gaps, 50),
+            "p90": _percentile(gaps, 90),
+            "p99": _percentile(gaps, 99),
+            "max": max(gaps)
+        } if gaps else None,
+        "thinking_seconds": thinking_seconds,
+        "code_seconds": code_seconds,
+        "thinking_time_share": thinking_seconds / total_seconds if total_seconds > 0 else None
+    }
+
+def append_metrics_log(record: Dict, path: str):
+    """Append one request's metrics record to a JSON-lines file."""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def normalize_prompt(prompt: str) -> str:
+    """Fold whitespace and trailing punctuation so near-identical prompts share a cache entry."""
+    return " ".join(prompt.split()).rstrip(".!?")
+
+_response_cache = None
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide response cache, creating it on first use."""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
+
+class CodeBlockStreamParser:
+    r"""
+    Incrementally tracks the first fenced Python code block in a token stream.
+
+    Anything inside <think>...</think> is ignored, since Qwen3 often sketches
+    code while reasoning. Fences are paired up line by line from the start of
+    the answer, so a block in another language (e.g. ```bash) is skipped as a
+    whole; the first block tagged python, py or nothing is the code. Once its
+    closing fence arrives, `closed` is set and `code` holds the block.
+
+    >>> parser = CodeBlockStreamParser()
+    >>> parser.feed("Install:\n```bash\npip install manim\n```\nThen\n```python\na=1\n```\n")
+    True
+    >>> parser.code
+    'a=1'
+    """
+
+    FENCE_LINE = re.compile(r"[ \t]*```[ \t]*([\w+-]*)[ \t\r]*")
+    CLOSING_FENCE = re.compile(r"\n```[ \t]*\n")
+    CODE_LANGUAGES = ("", "python", "py", "python3")
 
+    def __init__(self):
+        self.text = ""
+        self.code_start = None
+        self.code_end = None
+        # Start of the first line not yet scanned for fences
+        self._scan_from = 0
+        self._in_other_block = False
+
+    @property
+    def closed(self) -> bool:
+        return self.code_end is not None
+
+    @property
+    def code(self) -> str:
+        """The complete code block, or None until its closing fence has streamed in."""
+        return self.text[self.code_start:self.code_end] if self.closed else None
+
+    @property
+    def partial_code(self) -> str:
+        """Code received so far (without a half-streamed closing fence), or "" before the block opens."""
+        if self.code_start is None:
+            return ""
+        if self.closed:
+            return self.code
+        partial = self.text[self.code_start:]
+        # Drop a closing fence that is still arriving, e.g. a trailing "\n``"
+        return re.sub(r"\n[ \t]*`{1,3}[ \t]*$", "", partial)
+
+    def feed(self, content: str) -> bool:
+        """Add streamed text. Returns True once the code block has closed."""
+        if self.closed:
+            return True
+        self.text += content
+
+        if self.code_start is None and not self._find_opening_fence():
+            return False
+
+        # Include the newline before the fence in the search so an empty block still matches
+        closing = self.CLOSING_FENCE.search(self.text, self.code_start - 1)
+        if closing:
+            self.code_end = max(closing.start(), self.code_start)
+        return self.closed
+
+    def _find_opening_fence(self) -> bool:
+        """Scan complete lines for fences, setting code_start at the first Python block. Returns True if found."""
+        while True:
+            line_end = self.text.find("\n", self._scan_from)
+            if line_end == -1:
+                return False
+            think_start = self.text.find("<think>", self._scan_from, line_end)
+            if think_start != -1:
+                think_end = self.text.find("</think>", think_start)
+                if think_end == -1:
+                    return False
+                self._scan_from = think_end + len("</think>")
+                continue
+            fence = self.FENCE_LINE.fullmatch(self.text, self._scan_from, line_end)
+            self._scan_from = line_end + 1
+            if not fence:
+                continue
+            if self._in_other_block:
+                # Only a bare fence closes a block
+                self._in_other_block = bool(fence.group(1))
+            elif fence.group(1).lower() in self.CODE_LANGUAGES:
+                self.code_start = self._scan_from
+                return True
+            else:
+                self._in_other_block = True
+
+    def finish(self):
+        """Mark the stream as ended; a block still open (e.g. "```" as the last token) ends here."""
+        if self.code_start is not None and not self.closed:
+            self.code_end = self.code_start + len(self.partial_code)
+
+def validate_and_render(code: str, output_dir: str = "videos") -> str:
+    """
+    Cheaply check generated code, then render it.
+
+    Returns:
+        str: Path to the generated video, or None if the code is invalid or rendering failed
+    """
+    cleaned_code = clean_manim_code(code)
     try:
+        compile(cleaned_code, "<generated>", "exec")
+    except SyntaxError as e:
+        print(f"\nSkipping render, generated code has a syntax error: {e}")
+        return None
+    return generate_video_from_code(cleaned_code, output_dir)
+
+class AsyncInferenceClient:
+    """
+    Asyncio client for the Hugging Face (TGI) endpoint.
+
+    Keeps one pooled keep-alive HTTP client, caps the number of requests in
+    flight, and applies a timeout to every request so a stuck stream can't hold
+    a slot forever. With a ResponseCache, repeated prompts skip the endpoint.
+    Every request gets a latency record, appended to `metrics_log` if set.
+    """
+
+    def __init__(self, base_url: str = None, api_key: str = None, model: str = "tgi",
+                 max_in_flight: int = 8, timeout: float = 300.0, cache: ResponseCache = None,
+                 metrics_log: str = DEFAULT_METRICS_LOG):
+        self.model = model
+        self.metrics_log = metrics_log
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.cache = cache
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+        # One connection per in-flight request, kept alive between requests
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight),
+            timeout=httpx.Timeout(timeout)
+        )
+        self.client = AsyncOpenAI(
+            base_url=base_url or os.getenv('HUGGINGFACE_BASE_URL'),
+            api_key=api_key or os.getenv('HUGGINGFACE_API_KEY'),
+            http_client=self._http_client
+        )
+
+    async def generate(self, prompt: str, max_tokens: int = 4096, on_token: Callable[[str], None] = None,
+                       on_partial_code: Callable[[str], None] = None, stop_at_code_end: bool = True,
+                       render: bool = False, temperature: float = None, top_p: float = None,
+                       use_cache: bool = True, thinking: str = "full", thinking_budget: int = None) -> Dict:
+        """
+        Stream a completion for one prompt.
+
+        Args:
+            prompt (str): The animation prompt
+            max_tokens (int): Maximum tokens to generate
+            on_token (Callable): Called with each streamed chunk of text
+            on_partial_code (Callable): Called with the code block received so far whenever it grows
+            stop_at_code_end (bool): Cancel the generation once the fenced code block closes
+            render (bool): Validate and render the code as soon as its block closes,
+                overlapping with the rest of the stream
+            temperature (float): Sampling temperature (endpoint default if None)
+            top_p (float): Nucleus sampling threshold (endpoint default if None)
+            use_cache (bool): Set to False to bypass the response cache
+            thinking (str): One of THINKING_MODES
+            thinking_budget (int): Thinking tokens allowed in "capped" mode (default DEFAULT_THINKING_BUDGET)
+
+        Returns:
+            Dict: {"prompt", "response", "code", "stopped_early", "cached", "video_path", "error",
+                "thinking_tokens", "code_tokens", "metrics"}; response is None on failure, code is None if no
+                closed code block was found. Token counts are streamed chunks inside and after <think>...</think>,
+                and metrics is the request's latency record (see summarize_stream_timing)
+        """
+        if thinking not in THINKING_MODES:
+            raise ValueError(f"Unknown thinking mode {thinking!r}, expected one of {THINKING_MODES}")
+        if thinking == "capped" and thinking_budget is None:
+            thinking_budget = DEFAULT_THINKING_BUDGET
+
+        result = {"prompt": prompt, "response": None, "code": None, "stopped_early": False, "cached": False,
+                  "video_path": None, "error": None, "thinking_tokens": 0, "code_tokens": 0, "metrics": None}
+        parser = CodeBlockStreamParser()
+        render_task = None
+        sampling = {name: value for name, value in (("temperature", temperature), ("top_p", top_p))
+                    if value is not None}
+
+        cache = self.cache if use_cache else None
+        cache_key = ResponseCache.make_key(
+            endpoint=str(self.client.base_url), model=self.model, prompt=normalize_prompt(prompt),
+            max_tokens=max_tokens, sampling=sampling, stop_at_code_end=stop_at_code_end, thinking=thinking,
+            thinking_budget=thinking_budget
+        ) if cache else None
+        cached = cache.get(cache_key) if cache else None
+        if cached:
+            result.update(cached, cached=True)
+            self._record_metrics(result, thinking, summarize_stream_timing(0.0, []))
+            if on_token:
+                on_token(result["response"])
+            if on_partial_code and result["code"]:
+                on_partial_code(result["code"])
+            if render:
+                result["video_path"] = await asyncio.get_running_loop().run_in_executor(
+                    None, validate_and_render, result["code"] or result["response"]
+                )
+            return result
+
+        def on_code_complete(code):
+            nonlocal render_task
+            if render:
+                loop = asyncio.get_running_loop()
+                render_task = loop.run_in_executor(None, validate_and_render, code)
+
+        chunk_times = []
+        async with self._semaphore:
+            request_start = time.perf_counter()
+            try:
+                (result["response"], result["stopped_early"], result["thinking_tokens"],
+                 result["code_tokens"]) = await asyncio.wait_for(
+                    self._stream_completion(prompt, max_tokens, sampling, on_token, parser, on_partial_code,
+                                            on_code_complete, stop_at_code_end, thinking, thinking_budget,
+                                            chunk_times),
+                    self.timeout
+                )
+                result["code"] = parser.code
+                if cache and result["response"]:
+                    cache.put(cache_key, {key: result[key] for key in
+                                          ("response", "code", "stopped_early", "thinking_tokens", "code_tokens")})
+            except asyncio.TimeoutError:
+                result["error"] = f"Request timed out after {self.timeout}s"
+            except Exception as e:
+                result["error"] = str(e)
+        self._record_metrics(result, thinking, summarize_stream_timing(request_start, chunk_times))
+
+        # Wait for the render outside the semaphore so the slot goes to the next request
+        if render and result["response"] and render_task is None:
+            # The block only closed with the stream, or the response has no fences at all
+            render_task = asyncio.get_running_loop().run_in_executor(
+                None, validate_and_render, result["code"] or result["response"]
+            )
+        if render_task is not None:
+            result["video_path"] = await render_task
+
+        return result
+
+    async def _stream_completion(self, prompt: str, max_tokens: int, sampling: Dict[str, float],
+                                 on_token: Callable[[str], None],
+                                 parser: CodeBlockStreamParser, on_partial_code: Callable[[str], None],
+                                 on_code_complete: Callable[[str], None], stop_at_code_end: bool,
+                                 thinking: str = "full", thinking_budget: int = None,
+                                 chunk_times: List[Tuple[float, bool]] = None):
+        user_content = f"{prompt}\nPlease provide complete, runnable Manim code."
+        extra_body = {}
+        if thinking == "off":
+            # Qwen3's soft switch works on any server; chat_template_kwargs is honored by TGI/vLLM
+            user_content += " /no_think"
+            extra_body["chat_template_kwargs"] = {"enable_thinking": False}
+        messages = [
+            {
+                "role": "user",
+                "content": user_content
+            }
+        ]
+
         # Create a chat completion request
-        chat_completion = client.chat.completions.create(
-            model="tgi",
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"{prompt}\nPlease provide complete, runnable Manim code."
-                }
-            ],
-            max_tokens=4096,  # Maximum allowed tokens
-            stream=True
+        chat_completion = await self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            stream=True,
+            **sampling,
+            **({"extra_body": extra_body} if extra_body else {})
         )
 
-        # Collect the complete response
+        # Collect the response, watching for the end of the code block
         full_response = ""
-        print("\nResponse:")
-        for message in chat_completion:
-            if message.choices[0].delta.content:
-                content = message.choices[0].delta.content
-                full_response += content
-                print(content, end="", flush=True)
+        partial_code = ""
+        token_counts = {"thinking": 0, "code": 0}
+
+        def in_thinking():
+            return full_response.lstrip().startswith("<think>") and "</think>" not in full_response
+
+        def emit(content, generated=True):
+            """Append text to the response; `generated=False` for text we insert, which isn't counted or timed."""
+            nonlocal full_response, partial_code
+            if generated:
+                # A chunk counts as thinking if the think block was still open when it arrived
+                thinking_chunk = "</think>" not in full_response and (full_response + content).lstrip().startswith("<think>")
+                token_counts["thinking" if thinking_chunk else "code"] += 1
+                if chunk_times is not None:
+                    chunk_times.append((time.perf_counter(), thinking_chunk))
+            full_response += content
+            if on_token:
+                on_token(content)
+
+            closed = parser.feed(content)
+            if on_partial_code and parser.partial_code != partial_code:
+                partial_code = parser.partial_code
+                on_partial_code(partial_code)
+            return closed
+
+        async def consume(stream, text_of):
+            """Returns "code_end" or "budget" if the stream was closed early, None if it ran out."""
+            nonlocal on_code_complete
+            async for message in stream:
+                content = text_of(message)
+                if not content:
+                    continue
 
+                if emit(content):
+                    on_code_complete(parser.code)
+                    if stop_at_code_end:
+                        # Closing the stream drops the connection, which cancels generation server-side
+                        await stream.close()
+                        return "code_end"
+                    # Keep streaming the trailing prose, but only hand off the code once
+                    on_code_complete = lambda code: None
+                elif thinking == "capped" and in_thinking() and token_counts["thinking"] >= thinking_budget:
+                    await stream.close()
+                    return "budget"
+            return None
+
+        outcome = await consume(chat_completion,
+                                lambda message: message.choices[0].delta.content if message.choices else None)
+
+        if outcome == "budget":
+            # Close the think block ourselves and let the model continue the prefilled assistant message;
+            # the server still applies its own chat template (continue_final_message is vLLM's and
+            # examples/batching_server.py's flag for not starting a new turn)
+            emit("\n</think>\n\n", generated=False)
+            continuation = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages + [{"role": "assistant", "content": full_response}],
+                max_tokens=max(max_tokens - sum(token_counts.values()), 1),
+                stream=True,
+                **sampling,
+                extra_body=dict(extra_body, continue_final_message=True, add_generation_prompt=False)
+            )
+            outcome = await consume(continuation,
+                                    lambda message: message.choices[0].delta.content if message.choices else None)
+
+        if outcome != "code_end":
+            parser.finish()
+        return full_response, outcome == "code_end", token_counts["thinking"], token_counts["code"]
+
+    def _record_metrics(self, result: Dict, thinking: str, timing: Dict):
+        """Attach the latency record to the result and append it to the metrics log."""
+        result["metrics"] = {
+            "timestamp": datetime.now().isoformat(),
+            "model": self.model,
+            "prompt": result["prompt"],
+            "thinking": thinking,
+            "cached": result["cached"],
+            "error": result["error"],
+            "thinking_tokens": result["thinking_tokens"],
+            "code_tokens": result["code_tokens"],
+            **timing
+        }
+        if self.metrics_log:
+            append_metrics_log(result["metrics"], self.metrics_log)
+
+    async def generate_many(self, prompts: List[str], max_tokens: int = 4096, thinking: str = "full",
+                            thinking_budget: int = None) -> AsyncIterator[Dict[str, str]]:
+        """
+        Generate completions for many prompts concurrently (up to max_in_flight at a time),
+        yielding each result as soon as it completes.
+        """
+        tasks = [asyncio.create_task(self.generate(prompt, max_tokens, thinking=thinking, thinking_budget=thinking_budget))
+                 for prompt in prompts]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # Stop outstanding requests if the caller stops iterating early
+            for task in tasks:
+                task.cancel()
+
+    async def aclose(self):
+        """Close the pooled HTTP connections."""
+        await self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+def generate_animation_code(prompt, use_cache=True, thinking="full", thinking_budget=None):
+    print(f"Sending prompt: {prompt}")
+
+    async def request():
+        # The pooled client is bound to this event loop, so it lives only for this call
+        async with AsyncInferenceClient(max_in_flight=1, cache=get_response_cache()) as inference_client:
+            print("\nResponse:")
+            # Generation stops as soon as the code block closes, and rendering starts right then
+            return await inference_client.generate(
+                prompt, on_token=lambda content: print(content, end="", flush=True), render=True,
+                use_cache=use_cache, thinking=thinking, thinking_budget=thinking_budget
+            )
+
+    try:
+        result = asyncio.run(request())
         print("\n")
 
-        # Generate video from the code
-        if full_response:
-            video_path = generate_video_from_code(full_response)
-            if video_path:
-                print(f"\nVideo generated successfully at: {video_path}")
+        if result["error"]:
+            print(f"Error: {result['error']}")
+            return result
+        print(f"Tokens: {result['thinking_tokens']} thinking, {result['code_tokens']} code")
+        metrics = result["metrics"]
+        if metrics["ttft_seconds"] is not None:
+            latency = metrics["inter_token_latency"] or {}
+            print(f"Time to first token {metrics['ttft_seconds']:.2f}s, {metrics['tokens_per_second']:.1f} tokens/s, "
+                  f"inter-token p50 {latency.get('p50', 0) * 1000:.0f}ms / p99 {latency.get('p99', 0) * 1000:.0f}ms, "
+                  f"{metrics['thinking_time_share']:.0%} of the time thinking")
+        if result["cached"]:
+            print(f"(served from response cache, hit rate {get_response_cache().stats()['hit_rate']:.0%})")
+
+        if result["response"]:
+            if result["video_path"]:
+                print(f"\nVideo generated successfully at: {result['video_path']}")
             else:
                 print("\nFailed to generate video")
 
+        return result
+
     except Exception as e:
         print(f"Error: {e}")
 
+async def generate_animation_code_batch(prompts: List[str], max_in_flight: int = 8):
+    """Generate code for many prompts at once, printing each result as it completes."""
+    async with AsyncInferenceClient(max_in_flight=max_in_flight, cache=get_response_cache()) as inference_client:
+        async for result in inference_client.generate_many(prompts):
+            status = f"{len(result['response'])} chars" if result["response"] else f"failed ({result['error']})"
+            print(f"{result['prompt'][:60]}... -> {status}")
+    print(f"Response cache: {get_response_cache().stats()}")
+
 if __name__ == "__main__":
     animation_prompt = "Create a manim animation of a transformer architecture"
-    generate_animation_code(animation_prompt)
\ No newline at end of file
+    generate_animation_code(animation_prompt)
@@ -0,0 +1,168 @@
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict
+
+# video_generator lives at the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from video_generator import (clean_manim_code, extract_code_blocks, find_scene_classes, get_shared_tex_cache,
+                             scene_strings, write_manim_config)
+
+# Limits for each render
+EXECUTION_RENDER_TIMEOUT = 120
+EXECUTION_MEMORY_LIMIT = 4 * 1024 ** 3
+
+# The only environment variables passed to the render process. This is not filesystem
+# isolation: scene code can still read any file the user can (.env.local included).
+RENDER_ENV_VARS = ("PATH", "HOME", "LANG", "LC_ALL", "TMPDIR", "TEXMFHOME", "TEXMFVAR", "PYTHONPATH")
+
+# Runs `python -m manim` after limiting the process's own memory and core dumps. Limits are
+# set in the child itself because preexec_fn isn't safe when scoring from several threads.
+LIMITED_LAUNCHER = """
+import resource, runpy, sys
+memory_limit = int(sys.argv.pop(1))
+resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+sys.argv[0] = "manim"
+runpy.run_module("manim", run_name="__main__", alter_sys=True)
+"""
+
+def extract_response_code(response: str) -> str:
+    """Pick the code to execute from a model response: the first fenced block defining a Scene, if any."""
+    blocks = extract_code_blocks(response)
+    for block in blocks:
+        if find_scene_classes(clean_manim_code(block)):
+            return block
+    return blocks[0] if blocks else response
+
+def _count_frames(video_file: str) -> int:
+    """Return the number of video frames in a file using ffprobe (None if it can't be read)."""
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets",
+             "-show_entries", "stream=nb_read_packets", "-of", "csv=p=0", video_file],
+            capture_output=True, text=True, check=True, timeout=30
+        )
+        return int(result.stdout.strip())
+    except (subprocess.SubprocessError, ValueError, OSError):
+        return None
+
+def score_code(response: str, timeout: float = EXECUTION_RENDER_TIMEOUT,
+               memory_limit: int = EXECUTION_MEMORY_LIMIT) -> Dict[str, Any]:
+    """
+    Extract the code from a response and render its first scene at low quality in a separate process.
+
+    The render runs in a throwaway directory with only RENDER_ENV_VARS set, a memory
+    limit and its own process group, which is killed (with any LaTeX/ffmpeg children)
+    when the timeout expires. It is not isolated: the code runs with the user's file
+    and network access, so only score responses you would be willing to run yourself.
+
+    Returns:
+        Dict: compile_ok, render_ok, scene_name, render_seconds, frame_count, output_bytes and error
+    """
+    score = {
+        "compile_ok": False,
+        "render_ok": False,
+        "scene_name": None,
+        "render_seconds": None,
+        "frame_count": None,
+        "output_bytes": None,
+        "error": None
+    }
+
+    code = clean_manim_code(extract_response_code(response or ""))
+    try:
+        compile(code, "<response>", "exec")
+    except SyntaxError as e:
+        score["error"] = f"Syntax error: {e}"
+        return score
+    score["compile_ok"] = True
+
+    scenes = find_scene_classes(code)
+    if not scenes:
+        score["error"] = "No Scene subclass found"
+        return score
+    score["scene_name"] = scenes[0]
+
+    work_dir = tempfile.mkdtemp(prefix="execution_score_")
+    try:
+        scene_file = os.path.join(work_dir, "scene.py")
+        output_file = os.path.join(work_dir, "output.mp4")
+        with open(scene_file, "w", encoding="utf-8") as f:
+            f.write(code)
+
+        env = {name: os.environ[name] for name in RENDER_ENV_VARS if name in os.environ}
+        with get_shared_tex_cache().scratch(scene_strings(code)) as tex_dirs:
+            config_file = write_manim_config(tex_dirs, os.path.join(work_dir, "manim.cfg"))
+            command = [sys.executable, "-c", LIMITED_LAUNCHER, str(memory_limit), "-ql", "--disable_caching",
+                       "--media_dir", os.path.join(work_dir, "media"), "-o", output_file, "--config_file", config_file,
+                       scene_file, score["scene_name"]]
+
+            start = time.perf_counter()
+            process = subprocess.Popen(
+                command, cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                text=True, start_new_session=True
+            )
+            try:
+                _, stderr = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.communicate()
+                score["error"] = f"Render timed out ({timeout}s limit)"
+                return score
+            finally:
+                score["render_seconds"] = time.perf_counter() - start
+
+        if process.returncode != 0 or not os.path.exists(output_file):
+            score["error"] = f"Render failed: {stderr.strip()[-500:]}"
+            return score
+
+        score["render_ok"] = True
+        score["frame_count"] = _count_frames(output_file)
+        score["output_bytes"] = os.path.getsize(output_file)
+        return score
+
+    except Exception as e:
+        score["error"] = f"Error running Manim: {e}"
+        return score
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+class ExecutionScorer:
+    """
+    Pool of resource-limited renders that scores responses in the background.
+
+    Each worker drives one render process at a time, so submitting a response
+    never blocks the caller; scoring keeps pace with generation instead of
+    running after it.
+    """
+
+    def __init__(self, workers: int = None, timeout: float = EXECUTION_RENDER_TIMEOUT,
+                 memory_limit: int = EXECUTION_MEMORY_LIMIT):
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        # Renders are CPU-heavy (and ffmpeg is multithreaded), so leave half the cores free
+        self._executor = ThreadPoolExecutor(max_workers=workers or max(1, (os.cpu_count() or 2) // 2),
+                                            thread_name_prefix="execution-scorer")
+
+    def submit(self, response: str) -> Future:
+        """Queue a response for scoring; the Future resolves to score_code's result."""
+        return self._executor.submit(score_code, response, self.timeout, self.memory_limit)
+
+    def score(self, response: str) -> Dict[str, Any]:
+        """Score a response and wait for the result."""
+        return self.submit(response).result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
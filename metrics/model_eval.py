@@ -1,30 +1,217 @@
+import argparse
+import asyncio
+import glob
+import hashlib
 import json
+import math
 import os
+import random
+import statistics
+import sys
 import time
 from datetime import datetime
-from typing import Dict, List, Any
-from openai import OpenAI
+from typing import Dict, List, Any, Tuple
+from openai import AsyncOpenAI, OpenAI, RateLimitError
 from dotenv import load_dotenv
 import traceback
+from execution_scorer import ExecutionScorer
+from metric_dataset import create_complete_evaluation_dataset
+
+# response_cache lives at the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from response_cache import ResponseCache
 
 # Load environment variables
 load_dotenv('.env.local')
 
+# Per-provider limits: sustained requests per second, burst size, and requests in flight
+PROVIDER_RATE_LIMITS = {
+    "openrouter": {"requests_per_second": 2.0, "burst": 5, "max_in_flight": 10},
+    "huggingface": {"requests_per_second": 1.0, "burst": 4, "max_in_flight": 4}
+}
+MAX_RATE_LIMIT_RETRIES = 6
+
+# Prompt templates per provider; part of the cache key, so editing one invalidates its cached responses
+PROMPT_TEMPLATES = {
+    "huggingface": "{prompt}\nPlease provide complete, runnable Manim code.",
+    "openrouter": "{prompt}\nPlease provide complete, runnable Manim code for creating this mathematical visualization."
+}
+
+# Evaluation responses never expire, so past runs can be replayed offline
+DEFAULT_EVAL_CACHE_PATH = os.getenv(
+    "EVAL_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "3b1b", "eval_responses.sqlite3")
+)
+
+# Every (prompt, model) response is appended here as it arrives; compacted into the final JSON at the end
+CHECKPOINT_PATTERN = "evaluation_checkpoint_*.jsonl"
+
+def load_checkpoint(checkpoint_path: str) -> Dict[str, Any]:
+    """
+    Read a JSON-lines checkpoint.
+
+    Returns:
+        Dict: {"metadata": the run header (or {}), "prompts": {prompt_id: prompt fields},
+            "responses": {prompt_id: {model: response}}}; later lines win for repeated pairs
+    """
+    checkpoint = {"metadata": {}, "prompts": {}, "responses": {}}
+    # Binary, so a crash mid-way through a multibyte character only loses that line
+    with open(checkpoint_path, 'rb') as f:
+        for line in f:
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                # A line cut short by a crash
+                continue
+            
+            if record.get("type") == "run":
+                checkpoint["metadata"] = record["metadata"]
+            elif record.get("type") == "response":
+                prompt_id = record["prompt"]["prompt_id"]
+                checkpoint["prompts"][prompt_id] = record["prompt"]
+                checkpoint["responses"].setdefault(prompt_id, {})[record["model"]] = record["response"]
+            elif record.get("type") == "execution":
+                response = checkpoint["responses"].get(record["prompt_id"], {}).get(record["model"])
+                if response is not None:
+                    response["execution"] = record["execution"]
+    return checkpoint
+
+def compact_checkpoint(checkpoint_path: str, models: List[str] = None) -> Dict[str, Any]:
+    """
+    Build the final results format ({"metadata", "results"}) from a checkpoint, in prompt id order.
+    Prompts answered by only some models (e.g. after adaptive runs stop querying a model) are kept
+    with just those responses.
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    metadata = dict(checkpoint["metadata"])
+    models = models or metadata.get("models_tested") or sorted(
+        {model for responses in checkpoint["responses"].values() for model in responses})
+    
+    results = []
+    for prompt_id in sorted(checkpoint["responses"]):
+        responses = checkpoint["responses"][prompt_id]
+        model_responses = {model: responses[model] for model in models if model in responses}
+        if model_responses:
+            results.append({**checkpoint["prompts"][prompt_id], "model_responses": model_responses})
+    
+    metadata["models_tested"] = models
+    metadata["total_prompts"] = len(results)
+    metadata.setdefault("evaluation_end", None)
+    return {"metadata": metadata, "results": results}
+
+def stratified_order(queries: List[Dict], seed: int = 0) -> List[Dict]:
+    """
+    Order prompts so that every prefix is (close to) a proportional sample of each
+    (category, difficulty) stratum, with prompts shuffled within their stratum.
+    """
+    rng = random.Random(seed)
+    strata = {}
+    for query in queries:
+        strata.setdefault((query["category"], query["difficulty"]), []).append(query)
+    for members in strata.values():
+        rng.shuffle(members)
+    
+    total = len(queries)
+    taken = {key: 0 for key in strata}
+    ordered = []
+    for position in range(1, total + 1):
+        # Next prompt comes from the stratum furthest below its proportional share
+        key = max((key for key in strata if taken[key] < len(strata[key])),
+                  key=lambda key: position * len(strata[key]) / total - taken[key])
+        ordered.append(strata[key][taken[key]])
+        taken[key] += 1
+    return ordered
+
+def wilson_interval(successes: int, trials: int, confidence: float = 0.95) -> Tuple[float, float]:
+    """Wilson score confidence interval for a success rate"""
+    if trials == 0:
+        return 0.0, 1.0
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    rate = successes / trials
+    denominator = 1 + z * z / trials
+    center = (rate + z * z / (2 * trials)) / denominator
+    half_width = z * math.sqrt(rate * (1 - rate) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+class TokenBucket:
+    """Async token bucket: `rate` requests per second on average, bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a request may be sent"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for `seconds` (after a 429), and drop the saved-up burst"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
 class ModelEvaluator:
     """Evaluates multiple models against a dataset of prompts and logs responses"""
     
-    def __init__(self):
+    def __init__(self, use_cache: bool = True, cache_only: bool = False, refresh_models: List[str] = None,
+                 cache_path: str = DEFAULT_EVAL_CACHE_PATH):
+        """
+        Args:
+            use_cache: Read and write the persistent response cache
+            cache_only: Replay from the cache without any network calls; misses become failed responses
+            refresh_models: Model keys whose cached responses are ignored and overwritten
+            cache_path: SQLite file for the response cache
+        """
+        # Persistent cache of successful responses, keyed by provider, model, prompt, max_tokens and template
+        self.cache = ResponseCache(cache_path, max_entries=1000000, ttl_seconds=None) if use_cache or cache_only else None
+        self.cache_only = cache_only
+        self.refresh_models = set(refresh_models or [])
+        
+        def api_key(name):
+            # The clients refuse to construct without a key, even though a cache-only replay never uses them
+            return os.getenv(name) or ("cache-only" if cache_only else None)
+        
         # Initialize OpenRouter client for external models
         self.openrouter_client = OpenAI(
             base_url="https://openrouter.ai/api/v1",
-            api_key=os.getenv('OPENROUTER_API_KEY')
+            api_key=api_key('OPENROUTER_API_KEY')
         )
         
         # Initialize HuggingFace client for fine-tuned model
         self.hf_client = OpenAI(
             base_url=os.getenv('HUGGINGFACE_BASE_URL'),
-            api_key=os.getenv('HUGGINGFACE_API_KEY')
+            api_key=api_key('HUGGINGFACE_API_KEY')
         )
+
+        # Async clients for the concurrent evaluation engine (retries are handled by the rate limiter)
+        self.async_clients = {
+            "openrouter": AsyncOpenAI(
+                base_url="https://openrouter.ai/api/v1",
+                api_key=api_key('OPENROUTER_API_KEY'),
+                max_retries=0
+            ),
+            "huggingface": AsyncOpenAI(
+                base_url=os.getenv('HUGGINGFACE_BASE_URL'),
+                api_key=api_key('HUGGINGFACE_API_KEY'),
+                max_retries=0
+            )
+        }
+        self.rate_limits = PROVIDER_RATE_LIMITS
+        self._checkpoint = None
+        self._scorer = None
         
         # Define models to test
         self.models = {
@@ -83,77 +270,188 @@ class ModelEvaluator:
             print(f"❌ Error loading dataset: {e}")
             return []
     
-    def call_model(self, model_key: str, prompt: str, max_tokens: int = 2048) -> Dict[str, Any]:
-        """Call a specific model with the given prompt"""
+    def build_request(self, model_key: str, prompt: str, max_tokens: int = 2048) -> Dict[str, Any]:
+        """Build the chat completion arguments for a model"""
         model_config = self.models[model_key]
         
-        try:
-            if model_config["client"] == "huggingface":
-                # Call fine-tuned model
-                response = self.hf_client.chat.completions.create(
-                    model=model_config["model_name"],
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": f"{prompt}\nPlease provide complete, runnable Manim code."
-                        }
-                    ],
-                    max_tokens=max_tokens,
-                    stream=False
-                )
-                
-                return {
-                    "success": True,
-                    "response": response.choices[0].message.content,
-                    "model": model_key,
-                    "tokens_used": getattr(response.usage, 'total_tokens', None) if hasattr(response, 'usage') else None,
-                    "error": None
-                }
-                
-            elif model_config["client"] == "openrouter":
-                # Call OpenRouter model
-                response = self.openrouter_client.chat.completions.create(
-                    extra_headers={
-                        "HTTP-Referer": "https://github.com/your-repo",
-                        "X-Title": "Manim Model Evaluation"
-                    },
-                    model=model_config["model_name"],
-                    messages=[
-                        {
-                            "role": "user", 
-                            "content": f"{prompt}\nPlease provide complete, runnable Manim code for creating this mathematical visualization."
-                        }
-                    ],
-                    max_tokens=max_tokens
-                )
-                
-                return {
-                    "success": True,
-                    "response": response.choices[0].message.content,
-                    "model": model_key,
-                    "tokens_used": response.usage.total_tokens if hasattr(response, 'usage') else None,
-                    "error": None
-                }
+        if model_config["client"] == "huggingface":
+            # Call fine-tuned model
+            return {
+                "model": model_config["model_name"],
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": PROMPT_TEMPLATES["huggingface"].format(prompt=prompt)
+                    }
+                ],
+                "max_tokens": max_tokens,
+                "stream": False
+            }
         
-        except Exception as e:
+        # Call OpenRouter model
+        return {
+            "extra_headers": {
+                "HTTP-Referer": "https://github.com/your-repo",
+                "X-Title": "Manim Model Evaluation"
+            },
+            "model": model_config["model_name"],
+            "messages": [
+                {
+                    "role": "user", 
+                    "content": PROMPT_TEMPLATES["openrouter"].format(prompt=prompt)
+                }
+            ],
+            "max_tokens": max_tokens
+        }
+    
+    def format_response(self, model_key: str, response=None, error: Exception = None) -> Dict[str, Any]:
+        """Convert a completion (or the error from it) into a results entry"""
+        if error is not None:
             return {
                 "success": False,
                 "response": None,
                 "model": model_key,
                 "tokens_used": None,
-                "error": str(e)
+                "error": str(error)
             }
+        
+        usage = getattr(response, 'usage', None)
+        return {
+            "success": True,
+            "response": response.choices[0].message.content,
+            "model": model_key,
+            "tokens_used": getattr(usage, 'total_tokens', None),
+            "error": None
+        }
+    
+    def cache_key(self, model_key: str, prompt: str, max_tokens: int) -> str:
+        """Cache key for a call: provider, model name, prompt hash, max_tokens and prompt template"""
+        model_config = self.models[model_key]
+        return ResponseCache.make_key(
+            provider=model_config["client"],
+            model_name=model_config["model_name"],
+            prompt_sha256=hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+            max_tokens=max_tokens,
+            prompt_template=PROMPT_TEMPLATES[model_config["client"]]
+        )
     
-    def evaluate_single_prompt(self, prompt_data: Dict) -> Dict[str, Any]:
-        """Evaluate a single prompt across all models"""
+    def cached_response(self, model_key: str, prompt: str, max_tokens: int) -> Dict[str, Any]:
+        """
+        Return the cached result for a call, or None if the model has to be called.
+        In cache-only mode a miss returns a failed result instead, so nothing goes to the network.
+        """
+        if self.cache is not None and model_key not in self.refresh_models:
+            cached = self.cache.get(self.cache_key(model_key, prompt, max_tokens))
+            if cached is not None:
+                return {**cached, "model": model_key, "cached": True}
+        if self.cache_only:
+            return self.format_response(model_key, error=Exception("Not in cache (cache-only replay)"))
+        return None
+    
+    def store_response(self, model_key: str, prompt: str, max_tokens: int, result: Dict[str, Any]):
+        """Cache a successful result (failures are retried next time)"""
+        if self.cache is not None and result["success"]:
+            # Copy, since the result gets an "execution" entry later and the cache keeps values in memory
+            self.cache.put(self.cache_key(model_key, prompt, max_tokens), dict(result))
+    
+    def call_model(self, model_key: str, prompt: str, max_tokens: int = 2048) -> Dict[str, Any]:
+        """Call a specific model with the given prompt"""
+        cached = self.cached_response(model_key, prompt, max_tokens)
+        if cached is not None:
+            return cached
+        
+        client = self.hf_client if self.models[model_key]["client"] == "huggingface" else self.openrouter_client
+        
+        try:
+            response = client.chat.completions.create(**self.build_request(model_key, prompt, max_tokens))
+            result = self.format_response(model_key, response)
+        except Exception as e:
+            return self.format_response(model_key, error=e)
+        self.store_response(model_key, prompt, max_tokens, result)
+        return result
+    
+    async def call_model_async(self, model_key: str, prompt: str, max_tokens: int = 2048) -> Dict[str, Any]:
+        """Call a model under its provider's rate limit, backing off and retrying on 429s"""
+        cached = self.cached_response(model_key, prompt, max_tokens)
+        if cached is not None:
+            return cached
+        
+        provider = self.models[model_key]["client"]
+        client = self.async_clients[provider]
+        bucket = self._buckets[provider]
+        request = self.build_request(model_key, prompt, max_tokens)
+        
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            await bucket.acquire()
+            try:
+                async with self._in_flight[provider]:
+                    response = await client.chat.completions.create(**request)
+                result = self.format_response(model_key, response)
+                self.store_response(model_key, prompt, max_tokens, result)
+                return result
+            except RateLimitError as e:
+                if attempt == MAX_RATE_LIMIT_RETRIES:
+                    return self.format_response(model_key, error=e)
+                # Honor Retry-After if the provider sent it, else exponential backoff with jitter
+                retry_after = e.response.headers.get("retry-after") if e.response is not None else None
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = min(2 ** attempt, 60) * (1 + random.random())
+                print(f"      ⏳ {model_key} rate limited, backing off {delay:.1f}s")
+                # Pause the whole provider, not just this request
+                bucket.pause(delay)
+            except Exception as e:
+                return self.format_response(model_key, error=e)
+    
+    def _open_run(self, checkpoint_path: str, write_header: bool, score_execution: bool, render_workers: int):
+        """Open the checkpoint log, execution scorer and rate limiters for a run (call inside the event loop)"""
+        self._checkpoint = open(checkpoint_path, 'ab+')
+        # Terminate a line left half-written by a crash so the next record starts cleanly
+        # (bytes, since the cut may fall inside a multibyte character)
+        if self._checkpoint.tell() > 0:
+            self._checkpoint.seek(-1, os.SEEK_END)
+            if self._checkpoint.read(1) != b"\n":
+                self._checkpoint.write(b"\n")
+        if write_header:
+            self.append_checkpoint({"type": "run", "metadata": self.results["metadata"]})
+        print(f"📝 Checkpointing responses to: {checkpoint_path}")
+        
+        if score_execution:
+            self._scorer = ExecutionScorer(workers=render_workers)
+        
+        # Rate limiters are bound to this event loop
+        self._buckets = {provider: TokenBucket(limits["requests_per_second"], limits["burst"])
+                         for provider, limits in self.rate_limits.items()}
+        self._in_flight = {provider: asyncio.Semaphore(limits["max_in_flight"])
+                           for provider, limits in self.rate_limits.items()}
+    
+    def _close_run(self):
+        self._checkpoint.close()
+        self._checkpoint = None
+        if self._scorer is not None:
+            self._scorer.close()
+            self._scorer = None
+    
+    def append_checkpoint(self, record: Dict[str, Any]):
+        """Append one record to the checkpoint log (constant cost per response)"""
+        if self._checkpoint is None:
+            return
+        self._checkpoint.write((json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8'))
+        self._checkpoint.flush()
+    
+    async def evaluate_single_prompt(self, prompt_data: Dict, previous_responses: Dict[str, Dict] = None,
+                                     models: List[str] = None) -> Dict[str, Any]:
+        """
+        Evaluate a single prompt across all models, or just `models` (concurrently, within the provider limits).
+        Models with a successful response in previous_responses (from a resumed run) are not called again.
+        With execution scoring on, each successful response is rendered as soon as it arrives.
+        """
         prompt_id = prompt_data["id"]
         prompt_text = prompt_data["query"]
         category = prompt_data["category"]
         difficulty = prompt_data["difficulty"]
         
-        print(f"\n🔄 Evaluating Prompt {prompt_id}: {category} ({difficulty})")
-        print(f"   Prompt: {prompt_text[:80]}...")
-        
         prompt_results = {
             "prompt_id": prompt_id,
             "prompt_text": prompt_text,
@@ -163,27 +461,77 @@ class ModelEvaluator:
             "timestamp": datetime.now().isoformat(),
             "model_responses": {}
         }
+        prompt_fields = {key: value for key, value in prompt_results.items() if key != "model_responses"}
         
-        # Test each model
-        for model_key in self.models.keys():
-            print(f"   📡 Testing {model_key}...")
+        models = models or list(self.models)
+        previous_responses = previous_responses or {}
+        done = {model_key: response for model_key, response in previous_responses.items()
+                if model_key in models and response["success"]}
+        
+        async def score_execution(model_key, result):
+            # Renders run in the scorer's pool, so the network stage keeps going meanwhile
+            result["execution"] = await asyncio.wrap_future(self._scorer.submit(result["response"]))
+            self.append_checkpoint({"type": "execution", "prompt_id": prompt_id, "model": model_key,
+                                    "execution": result["execution"]})
+        
+        async def evaluate_model(model_key):
+            result = await self.call_model_async(model_key, prompt_text)
+            self.append_checkpoint({"type": "response", "prompt": prompt_fields, "model": model_key,
+                                    "response": result})
+            if self._scorer is not None and result["success"]:
+                await score_execution(model_key, result)
+            return result
+        
+        # Test each model (and score resumed responses that were never rendered)
+        models_to_call = [model_key for model_key in models if model_key not in done]
+        unscored = [model_key for model_key, response in done.items()
+                    if self._scorer is not None and "execution" not in response]
+        results = await asyncio.gather(*(evaluate_model(m) for m in models_to_call),
+                                       *(score_execution(m, done[m]) for m in unscored))
+        results = dict(zip(models_to_call, results))
+        
+        print(f"\n🔄 Evaluated Prompt {prompt_id}: {category} ({difficulty})")
+        print(f"   Prompt: {prompt_text[:80]}...")
+        for model_key in models:
+            if model_key in done:
+                prompt_results["model_responses"][model_key] = done[model_key]
+                print(f"   ⏭️  {model_key}: already completed")
+                continue
             
-            result = self.call_model(model_key, prompt_text)
+            result = results[model_key]
             prompt_results["model_responses"][model_key] = result
             
             if result["success"]:
                 response_preview = result["response"][:100] if result["response"] else "No response"
-                print(f"      ✅ Success: {response_preview}...")
+                print(f"   ✅ {model_key}: {response_preview}...")
+                if "execution" in result:
+                    execution = result["execution"]
+                    status = "rendered" if execution["render_ok"] else execution["error"]
+                    print(f"      🎬 {status}")
             else:
-                print(f"      ❌ Failed: {result['error']}")
-            
-            # Rate limiting for OpenRouter
-            time.sleep(1)
+                print(f"   ❌ {model_key} failed: {result['error']}")
         
         return prompt_results
     
-    def run_evaluation(self, dataset_path: str, output_path: str = None, limit: int = None):
+    def run_evaluation(self, dataset_path: str, output_path: str = None, limit: int = None,
+                       checkpoint_path: str = None, resume: bool = False, score_execution: bool = False,
+                       render_workers: int = None):
         """Run complete evaluation across all models and prompts"""
+        return asyncio.run(self.run_evaluation_async(dataset_path, output_path, limit, checkpoint_path, resume,
+                                                     score_execution, render_workers))
+    
+    async def run_evaluation_async(self, dataset_path: str, output_path: str = None, limit: int = None,
+                                   checkpoint_path: str = None, resume: bool = False,
+                                   score_execution: bool = False, render_workers: int = None):
+        """
+        Evaluate all (prompt, model) pairs concurrently, bounded by the per-provider rate limits.
+        
+        Each response is appended to a JSON-lines checkpoint as soon as it arrives. With resume,
+        checkpoint_path (default: the most recent checkpoint) is read first and successful pairs
+        are skipped; failed ones are retried. With score_execution, successful responses are also
+        rendered in a pool of render_workers separate, resource-limited processes and get an "execution" entry
+        (compile_ok, render_ok, render_seconds, frame_count, output_bytes).
+        """
         print("🚀 Starting Model Evaluation")
         print("="*60)
         
@@ -202,25 +550,55 @@ class ModelEvaluator:
         self.results["metadata"]["evaluation_start"] = datetime.now().isoformat()
         self.results["metadata"]["total_prompts"] = len(prompts)
         
-        # Evaluate each prompt
-        for i, prompt_data in enumerate(prompts):
-            try:
-                prompt_result = self.evaluate_single_prompt(prompt_data)
-                self.results["results"].append(prompt_result)
-                
-                # Save intermediate results every 10 prompts
-                if (i + 1) % 10 == 0:
-                    self.save_results(output_path, intermediate=True)
-                    print(f"📊 Progress: {i + 1}/{len(prompts)} prompts completed")
-                
-            except Exception as e:
-                print(f"❌ Error evaluating prompt {prompt_data['id']}: {e}")
-                print(traceback.format_exc())
+        previous = {"metadata": {}, "responses": {}}
+        if resume:
+            if checkpoint_path is None:
+                checkpoints = glob.glob(CHECKPOINT_PATTERN)
+                checkpoint_path = max(checkpoints, key=os.path.getmtime) if checkpoints else None
+            if checkpoint_path and os.path.exists(checkpoint_path):
+                previous = load_checkpoint(checkpoint_path)
+                self.results["metadata"]["evaluation_start"] = previous["metadata"].get(
+                    "evaluation_start", self.results["metadata"]["evaluation_start"])
+                completed_pairs = sum(1 for responses in previous["responses"].values()
+                                      for response in responses.values() if response["success"])
+                print(f"♻️  Resuming from {checkpoint_path}: {completed_pairs} responses already completed")
+            else:
+                print("⚠️  No checkpoint to resume from, starting a new run")
+        if checkpoint_path is None:
+            checkpoint_path = CHECKPOINT_PATTERN.replace("*", datetime.now().strftime("%Y%m%d_%H%M%S"))
+        
+        self._open_run(checkpoint_path, not previous["metadata"], score_execution, render_workers)
+        
+        # Evaluate every prompt at once; the rate limiters decide what actually runs
+        tasks = {asyncio.ensure_future(self.evaluate_single_prompt(prompt_data,
+                                                                   previous["responses"].get(prompt_data["id"]))): prompt_data
+                 for prompt_data in prompts}
+        completed = {}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    prompt_data = tasks[task]
+                    try:
+                        completed[prompt_data["id"]] = task.result()
+                    except Exception as e:
+                        print(f"❌ Error evaluating prompt {prompt_data['id']}: {e}")
+                        print(traceback.format_exc())
+                        continue
+                    
+                    if len(completed) % 10 == 0:
+                        print(f"📊 Progress: {len(completed)}/{len(prompts)} prompts completed")
+        finally:
+            self._close_run()
+        
+        # Keep the dataset order regardless of completion order
+        self.results["results"] = [completed[p["id"]] for p in prompts if p["id"] in completed]
         
         # Finalize evaluation
         self.results["metadata"]["evaluation_end"] = datetime.now().isoformat()
         
-        # Save final results
+        # Compact: write the final JSON once, from the completed run
         final_output = self.save_results(output_path)
         
         # Print summary
@@ -228,6 +606,154 @@ class ModelEvaluator:
         
         return final_output
     
+    def run_adaptive_evaluation(self, categories: List[str] = None, output_path: str = None, **kwargs):
+        """Run the adaptive (sequential, stratified) evaluation"""
+        return asyncio.run(self.run_adaptive_evaluation_async(categories, output_path, **kwargs))
+    
+    async def run_adaptive_evaluation_async(self, categories: List[str] = None, output_path: str = None,
+                                            confidence: float = 0.95, target_half_width: float = 0.1,
+                                            min_prompts: int = 20, batch_size: int = 10, seed: int = 0,
+                                            render_workers: int = None):
+        """
+        Evaluate models on a stratified sample, dropping each model once its result is settled.
+        
+        Prompts from create_complete_evaluation_dataset (optionally only `categories`) are
+        ordered so every prefix is stratified by category and difficulty, then evaluated in
+        batches. Responses are always execution scored, and success means the response
+        rendered (nearly every API call succeeds, so that alone would settle every model
+        after min_prompts). After each batch, a model with at least min_prompts scored
+        responses stops being queried once the Wilson interval of its render success rate
+        is narrower than +/- target_half_width, or no longer overlaps any other model's
+        interval, so its ranking is settled. Intervals are per model, without a
+        multiple-comparison correction.
+        
+        inappropriate_topics prompts are still sent, but a refusal is the right answer there,
+        so they don't count toward the success rates; see ResultsAnalyzer's refusal analysis.
+        """
+        print("🚀 Starting Adaptive Model Evaluation")
+        print("="*60)
+        
+        dataset = create_complete_evaluation_dataset()
+        queries = [query for query in dataset["queries"] if not categories or query["category"] in categories]
+        if not queries:
+            print(f"❌ No prompts in categories: {', '.join(categories)}")
+            return
+        prompts = stratified_order(queries, seed)
+        
+        models = list(self.models)
+        self.results["metadata"]["evaluation_start"] = datetime.now().isoformat()
+        self.results["metadata"]["dataset_file"] = "metric_dataset.create_complete_evaluation_dataset"
+        
+        def succeeded(response):
+            # Failed calls are never rendered, so they have no execution result
+            return response.get("execution", {}).get("render_ok", False)
+        
+        tallies = {model_key: {"successes": 0, "prompts": 0} for model_key in models}
+        stopped = {}
+        active = list(models)
+        results = []
+        # Network calls for scored prompts; cache hits and refusal prompts are counted separately
+        calls_made = 0
+        cache_hits = 0
+        refusal_calls = 0
+        
+        def network_calls(prompt_result):
+            return sum(1 for response in prompt_result["model_responses"].values()
+                       if not response.get("cached") and not self.cache_only)
+        
+        checkpoint_path = CHECKPOINT_PATTERN.replace("*", datetime.now().strftime("%Y%m%d_%H%M%S"))
+        self._open_run(checkpoint_path, True, True, render_workers)
+        try:
+            for start in range(0, len(prompts), batch_size):
+                if not active:
+                    break
+                batch = prompts[start:start + batch_size]
+                batch_results = await asyncio.gather(*(self.evaluate_single_prompt(prompt_data, models=active)
+                                                       for prompt_data in batch))
+                
+                for prompt_result in batch_results:
+                    results.append(prompt_result)
+                    if prompt_result["category"] == "inappropriate_topics":
+                        refusal_calls += network_calls(prompt_result)
+                        continue
+                    calls_made += network_calls(prompt_result)
+                    cache_hits += sum(1 for response in prompt_result["model_responses"].values()
+                                      if response.get("cached"))
+                    for model_key, response in prompt_result["model_responses"].items():
+                        tallies[model_key]["prompts"] += 1
+                        tallies[model_key]["successes"] += bool(succeeded(response))
+                
+                intervals = {model_key: wilson_interval(tally["successes"], tally["prompts"], confidence)
+                             for model_key, tally in tallies.items()}
+                for model_key in list(active):
+                    if tallies[model_key]["prompts"] < min_prompts:
+                        continue
+                    low, high = intervals[model_key]
+                    if (high - low) / 2 <= target_half_width:
+                        reason = "success rate known"
+                    elif all(high < intervals[other][0] or low > intervals[other][1]
+                             for other in models if other != model_key):
+                        reason = "ranking settled"
+                    else:
+                        continue
+                    active.remove(model_key)
+                    stopped[model_key] = reason
+                    print(f"🛑 {model_key} stopped after {tallies[model_key]['prompts']} prompts ({reason}): "
+                          f"{low * 100:.1f}%-{high * 100:.1f}%")
+                
+                print(f"📊 Progress: {len(results)}/{len(prompts)} prompts, {len(active)} models still active")
+        finally:
+            self._close_run()
+        
+        # Calls a full (non-adaptive, uncached) run would make for the scored prompts
+        calls_possible = sum(1 for prompt in prompts if prompt["category"] != "inappropriate_topics") * len(models)
+        calls_saved = calls_possible - calls_made - cache_hits
+        self.results["results"] = results
+        self.results["metadata"]["total_prompts"] = len(results)
+        self.results["metadata"]["evaluation_end"] = datetime.now().isoformat()
+        self.results["metadata"]["adaptive"] = {
+            "categories": categories,
+            "confidence": confidence,
+            "target_half_width": target_half_width,
+            "min_prompts": min_prompts,
+            "batch_size": batch_size,
+            "seed": seed,
+            "available_prompts": len(prompts),
+            "calls_possible": calls_possible,
+            "calls_made": calls_made,
+            "cache_hits": cache_hits,
+            "calls_saved": calls_saved,
+            "refusal_calls": refusal_calls,
+            "models": {
+                model_key: {
+                    **tallies[model_key],
+                    "success_rate": tallies[model_key]["successes"] / tallies[model_key]["prompts"]
+                                    if tallies[model_key]["prompts"] else None,
+                    "interval": list(wilson_interval(tallies[model_key]["successes"], tallies[model_key]["prompts"],
+                                                     confidence)),
+                    "stopped": stopped.get(model_key, "prompts exhausted")
+                }
+                for model_key in models
+            }
+        }
+        
+        final_output = self.save_results(output_path)
+        self.print_evaluation_summary()
+        
+        if calls_possible:
+            print(f"\n💰 Calls made: {calls_made}/{calls_possible} ({cache_hits} served from cache, "
+                  f"{calls_saved} saved by stopping early, {calls_saved / calls_possible * 100:.0f}%)")
+        if refusal_calls:
+            print(f"   Plus {refusal_calls} calls for inappropriate_topics prompts (not scored)")
+        ranking = sorted(models, key=lambda m: -(self.results["metadata"]["adaptive"]["models"][m]["success_rate"] or 0))
+        for model_key in ranking:
+            summary = self.results["metadata"]["adaptive"]["models"][model_key]
+            low, high = summary["interval"]
+            print(f"   {model_key}: {(summary['success_rate'] or 0) * 100:.1f}% "
+                  f"({low * 100:.1f}%-{high * 100:.1f}%) over {summary['prompts']} prompts, {summary['stopped']}")
+        
+        return final_output
+    
     def save_results(self, output_path: str = None, intermediate: bool = False) -> str:
         """Save evaluation results to JSON file"""
         if output_path is None:
@@ -257,13 +783,30 @@ class ModelEvaluator:
         total_prompts = len(self.results["results"])
         print(f"Total prompts evaluated: {total_prompts}")
         
-        # Success rates by model
+        # Success rates by model (adaptive runs stop querying some models early)
         print("\n🏆 Model Success Rates:")
         for model_key in self.models.keys():
-            successes = sum(1 for r in self.results["results"] 
-                          if r["model_responses"][model_key]["success"])
-            success_rate = (successes / total_prompts) * 100 if total_prompts > 0 else 0
-            print(f"   {model_key}: {successes}/{total_prompts} ({success_rate:.1f}%)")
+            responses = [r["model_responses"][model_key] for r in self.results["results"]
+                         if model_key in r["model_responses"]]
+            successes = sum(1 for response in responses if response["success"])
+            success_rate = (successes / len(responses)) * 100 if responses else 0
+            print(f"   {model_key}: {successes}/{len(responses)} ({success_rate:.1f}%)")
+        
+        # Execution results, if the responses were rendered
+        scored = [r["model_responses"] for r in self.results["results"]
+                  if any("execution" in response for response in r["model_responses"].values())]
+        if scored:
+            print("\n🎬 Execution (of successful responses):")
+            for model_key in self.models.keys():
+                executions = [responses[model_key]["execution"] for responses in scored
+                              if "execution" in responses.get(model_key, {})]
+                if not executions:
+                    continue
+                compiled = sum(1 for e in executions if e["compile_ok"])
+                rendered = [e for e in executions if e["render_ok"]]
+                avg_seconds = sum(e["render_seconds"] for e in rendered) / len(rendered) if rendered else 0
+                print(f"   {model_key}: compiles {compiled}/{len(executions)}, renders {len(rendered)}/{len(executions)}"
+                      f" (avg {avg_seconds:.1f}s per render)")
         
         # Category breakdown
         print("\n📂 Performance by Category:")
@@ -271,31 +814,73 @@ class ModelEvaluator:
         for result in self.results["results"]:
             cat = result["category"]
             if cat not in categories:
-                categories[cat] = {"total": 0, "model_successes": {}}
+                categories[cat] = {"total": 0, "model_totals": {}, "model_successes": {}}
             
             categories[cat]["total"] += 1
-            for model_key in self.models.keys():
+            for model_key, response in result["model_responses"].items():
+                categories[cat]["model_totals"][model_key] = categories[cat]["model_totals"].get(model_key, 0) + 1
                 if model_key not in categories[cat]["model_successes"]:
                     categories[cat]["model_successes"][model_key] = 0
                 
-                if result["model_responses"][model_key]["success"]:
+                if response["success"]:
                     categories[cat]["model_successes"][model_key] += 1
         
         for cat, data in categories.items():
             print(f"\n   {cat} ({data['total']} prompts):")
             for model_key in self.models.keys():
-                success_rate = (data["model_successes"][model_key] / data["total"]) * 100
+                if model_key not in data["model_totals"]:
+                    continue
+                success_rate = (data["model_successes"][model_key] / data["model_totals"][model_key]) * 100
                 print(f"      {model_key}: {success_rate:.1f}%")
 
 def main():
     """Main evaluation function"""
-    evaluator = ModelEvaluator()
+    parser = argparse.ArgumentParser(description="Evaluate models on the Manim prompt dataset")
+    parser.add_argument("--resume", nargs="?", const="latest", metavar="CHECKPOINT",
+                        help="Resume from a checkpoint (default: the most recent one), skipping completed pairs")
+    parser.add_argument("--compact", metavar="CHECKPOINT",
+                        help="Write the final results JSON from a checkpoint without calling any model")
+    parser.add_argument("--limit", type=int, help="Only evaluate the first N prompts")
+    parser.add_argument("--output", help="Path for the final results JSON")
+    parser.add_argument("--execute", action="store_true",
+                        help="Render each successful response and record compile/render results. Renders are memory "
+                             "and time limited but NOT isolated: generated code runs with your file and network access")
+    parser.add_argument("--render-workers", type=int, help="Concurrent renders (default: half the cores)")
+    parser.add_argument("--cache-only", action="store_true",
+                        help="Replay responses from the cache without any network calls")
+    parser.add_argument("--no-cache", action="store_true", help="Neither read nor write the response cache")
+    parser.add_argument("--refresh", nargs="+", metavar="MODEL", default=[],
+                        help="Ignore and overwrite cached responses for these models")
+    parser.add_argument("--clear-cache", action="store_true", help="Delete every cached response and exit")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Stratified sequential evaluation that stops querying a model once its render success "
+                             "rate is settled (always execution scores responses)")
+    parser.add_argument("--categories", nargs="+", help="Only use prompts from these categories (adaptive mode)")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level for the stopping rule")
+    parser.add_argument("--half-width", type=float, default=0.1,
+                        help="Stop once a success rate is known to within +/- this much")
+    args = parser.parse_args()
+    
+    if args.clear_cache:
+        ResponseCache(DEFAULT_EVAL_CACHE_PATH).invalidate()
+        print(f"🗑️  Cleared response cache: {DEFAULT_EVAL_CACHE_PATH}")
+        return
     
-    # Check required environment variables
+    if args.compact:
+        results = compact_checkpoint(args.compact)
+        output_path = args.output or args.compact.replace("evaluation_checkpoint_", "evaluation_results_").replace(".jsonl", ".json")
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"💾 Compacted {len(results['results'])} prompts into: {output_path}")
+        return
+    
+    evaluator = ModelEvaluator(use_cache=not args.no_cache, cache_only=args.cache_only, refresh_models=args.refresh)
+    
+    # Check required environment variables (a cache-only replay never calls the APIs)
     required_vars = ['OPENROUTER_API_KEY', 'HUGGINGFACE_BASE_URL', 'HUGGINGFACE_API_KEY']
     missing_vars = [var for var in required_vars if not os.getenv(var)]
     
-    if missing_vars:
+    if missing_vars and not args.cache_only:
         print(f"❌ Missing environment variables: {', '.join(missing_vars)}")
         print("Please set these in your .env.local file")
         return
@@ -303,10 +888,21 @@ def main():
     # Run evaluation
     dataset_path = "metrics/evaluation_dataset_complete.json"
     
+    if args.adaptive:
+        evaluator.run_adaptive_evaluation(args.categories, args.output, confidence=args.confidence,
+                                          target_half_width=args.half_width, render_workers=args.render_workers)
+        return
+    
+    if args.resume or args.limit or args.execute or args.cache_only or args.refresh:
+        checkpoint_path = None if args.resume in (None, "latest") else args.resume
+        evaluator.run_evaluation(dataset_path, args.output, args.limit, checkpoint_path, resume=bool(args.resume),
+                                 score_execution=args.execute, render_workers=args.render_workers)
+        return
+    
     print("🎯 Model Evaluation Options:")
     print("1. Run full evaluation (200 prompts)")
     print("2. Run test evaluation (10 prompts)")
-    print("3. Run category-specific evaluation")
+    print("3. Run category-specific evaluation (adaptive, renders responses: stops each model once its result is settled)")
     
     choice = input("\nSelect option (1-3): ").strip()
     
@@ -315,7 +911,11 @@ def main():
     elif choice == "2":
         evaluator.run_evaluation(dataset_path, limit=10)
     elif choice == "3":
-        print("Category-specific evaluation not yet implemented")
+        categories = create_complete_evaluation_dataset()["metadata"]["categories"]
+        print("\nCategories: " + ", ".join(categories))
+        selected = input("Categories to evaluate (comma-separated, blank for all): ").strip()
+        selected = [category.strip() for category in selected.split(",") if category.strip()] or None
+        evaluator.run_adaptive_evaluation(selected)
     else:
         print("Invalid choice. Running test evaluation...")
         evaluator.run_evaluation(dataset_path, limit=10)
@@ -27,13 +27,14 @@ class ResultsAnalyzer:
         if not self.data:
             return {}
         
-        total_prompts = len(self.data["results"])
         success_rates = {}
         
         for model in self.models:
-            successes = sum(1 for result in self.data["results"] 
-                          if result["model_responses"][model]["success"])
-            success_rates[model] = (successes / total_prompts) * 100 if total_prompts > 0 else 0
+            # Adaptive runs stop querying some models early, so count only prompts each model answered
+            responses = [result["model_responses"][model] for result in self.data["results"]
+                         if model in result["model_responses"]]
+            successes = sum(1 for response in responses if response["success"])
+            success_rates[model] = (successes / len(responses)) * 100 if responses else 0
         
         return success_rates
     
@@ -42,14 +43,14 @@ class ResultsAnalyzer:
         if not self.data:
             return {}
         
-        category_stats = defaultdict(lambda: {"total": 0, "successes": defaultdict(int)})
+        category_stats = defaultdict(lambda: {"totals": defaultdict(int), "successes": defaultdict(int)})
         
         for result in self.data["results"]:
             category = result["category"]
-            category_stats[category]["total"] += 1
             
-            for model in self.models:
-                if result["model_responses"][model]["success"]:
+            for model, response in result["model_responses"].items():
+                category_stats[category]["totals"][model] += 1
+                if response["success"]:
                     category_stats[category]["successes"][model] += 1
         
         # Convert to success rates
@@ -57,8 +58,9 @@ class ResultsAnalyzer:
         for category, stats in category_stats.items():
             category_performance[category] = {}
             for model in self.models:
-                success_rate = (stats["successes"][model] / stats["total"]) * 100
-                category_performance[category][model] = success_rate
+                if stats["totals"][model]:
+                    success_rate = (stats["successes"][model] / stats["totals"][model]) * 100
+                    category_performance[category][model] = success_rate
         
         return category_performance
     
@@ -78,9 +80,9 @@ class ResultsAnalyzer:
         
         for result in self.data["results"]:
             for model in self.models:
-                response_data = result["model_responses"][model]
+                response_data = result["model_responses"].get(model)
                 
-                if response_data["success"] and response_data["response"]:
+                if response_data and response_data["success"] and response_data["response"]:
                     response = response_data["response"]
                     code_quality[model]["total_responses"] += 1
                     
@@ -129,7 +131,9 @@ class ResultsAnalyzer:
         for result in self.data["results"]:
             if result["category"] == "inappropriate_topics":
                 for model in self.models:
-                    response_data = result["model_responses"][model]
+                    response_data = result["model_responses"].get(model)
+                    if response_data is None:
+                        continue
                     inappropriate_handling[model]["total_inappropriate"] += 1
                     
                     if response_data["success"] and response_data["response"]:
@@ -252,6 +256,8 @@ class ResultsAnalyzer:
             }
             
             for model in self.models:
+                if model not in result["model_responses"]:
+                    continue
                 model_data = result["model_responses"][model]
                 row = base_row.copy()
                 row.update({
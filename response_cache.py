@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+
+# Shared by inference.py and the evaluator; override with RESPONSE_CACHE_PATH
+DEFAULT_RESPONSE_CACHE_PATH = os.getenv(
+    "RESPONSE_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "3b1b", "responses.sqlite3")
+)
+
+class ResponseCache:
+    """
+    Cache for model responses: an in-memory LRU in front of a SQLite store on disk.
+
+    Entries expire `ttl_seconds` after they were written (None keeps them
+    forever), and the least recently used ones are dropped once the store holds
+    more than `max_entries`. Values can be anything JSON-serializable.
+    Access times of memory hits are written to disk in batches of
+    `ACCESS_FLUSH_SIZE` (and before evicting), so eviction order stays LRU.
+    """
+
+    ACCESS_FLUSH_SIZE = 64
+
+    def __init__(self, path: str = DEFAULT_RESPONSE_CACHE_PATH, memory_entries: int = 256,
+                 max_entries: int = 50000, ttl_seconds: float = 7 * 24 * 3600):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._pending_accesses = {}  # key -> access time not yet written to disk
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(**parts) -> str:
+        """Hash the given key parts (model, prompt, parameters, ...) into a cache key."""
+        encoded = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - created > self.ttl_seconds
+
+    def get(self, key: str) -> Any:
+        """Return the cached value for `key`, or None on a miss."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[1]):
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                self._pending_accesses[key] = time.time()
+                if len(self._pending_accesses) >= self.ACCESS_FLUSH_SIZE:
+                    self._flush_accesses()
+                    self._db.commit()
+                return entry[0]
+
+            row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or self._expired(row[1]):
+                self._memory.pop(key, None)
+                self.misses += 1
+                return None
+
+            value = json.loads(row[0])
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self._remember(key, value, row[1])
+            self.disk_hits += 1
+            return value
+
+    def put(self, key: str, value: Any):
+        """Store a value, evicting expired and least recently used entries."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self._remember(key, value, now)
+            self._evict()
+            self._db.commit()
+
+    def invalidate(self, key: str = None):
+        """Drop one entry, or everything if no key is given."""
+        with self._lock:
+            if key is None:
+                self._memory.clear()
+                self._pending_accesses.clear()
+                self._db.execute("DELETE FROM responses")
+            else:
+                self._memory.pop(key, None)
+                self._pending_accesses.pop(key, None)
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+
+    def _remember(self, key: str, value: Any, created: float):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _flush_accesses(self):
+        """Write batched memory-hit access times to disk (the caller commits)."""
+        if self._pending_accesses:
+            self._db.executemany("UPDATE responses SET accessed = ? WHERE key = ?",
+                                 [(accessed, key) for key, accessed in self._pending_accesses.items()])
+            self._pending_accesses.clear()
+
+    def _evict(self):
+        self._flush_accesses()
+        if self.ttl_seconds is not None:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl_seconds,))
+
+        excess = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                (excess,)
+            )
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters for this cache instance."""
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "entries": entries
+        }
+
+    def close(self):
+        with self._lock:
+            self._flush_accesses()
+            self._db.commit()
+        self._db.close()
@@ -1,6 +1,739 @@
+import ast
+import asyncio
+import glob
+import hashlib
+import importlib.util
+import json
+import logging
+import math
+import multiprocessing
 import os
+import re
+import shutil
+import signal
 import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from typing import Dict, List, Tuple
+
+# Render settings behind manim's -q<flag> CLI options, used to configure warm workers
+QUALITY_PRESETS = {
+    "l": {"pixel_height": 480, "pixel_width": 854, "frame_rate": 15},
+    "m": {"pixel_height": 720, "pixel_width": 1280, "frame_rate": 30},
+    "h": {"pixel_height": 1080, "pixel_width": 1920, "frame_rate": 60},
+    "p": {"pixel_height": 1440, "pixel_width": 2560, "frame_rate": 60},
+    "k": {"pixel_height": 2160, "pixel_width": 3840, "frame_rate": 60},
+}
+
+# Set in each pool worker: where jobs report which process picked them up
+_job_started_queue = None
+
+def _init_render_worker(job_started_queue=None):
+    """
+    Import manim once per worker so each job skips interpreter and library startup.
+    """
+    global _job_started_queue
+    _job_started_queue = job_started_queue
+    import manim  # noqa: F401
+
+class _LogRecorder(logging.Handler):
+    """Collects (seconds since start, message) pairs from manim's logger."""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.start = time.perf_counter()
+        self.events = []
+
+    def emit(self, record):
+        self.events.append((time.perf_counter() - self.start, record.getMessage()))
+
+def _render_in_worker(scene_file: str, scene_name: str, output_file: str, quality: str,
+                      animation_range: Tuple[int, int] = None,
+                      extra_config: Dict[str, str] = None, job_id: str = None,
+                      deadline: float = None) -> Tuple[str, List[Tuple[float, str]], float]:
+    """
+    Render a scene inside a warm worker. Runs in the pool's child process.
+
+    The job reports its worker's pid under `job_id` so the parent can kill it on
+    timeout, and gives up without rendering if it only starts after `deadline`
+    (a time.time() value), since the parent has stopped waiting by then.
+
+    Returns the output path, manim's timestamped log events and the job's wall time.
+    """
+    if deadline is not None and time.time() > deadline:
+        raise multiprocessing.TimeoutError("render timed out before a worker was free")
+    if job_id is not None and _job_started_queue is not None:
+        _job_started_queue.put((job_id, os.getpid()))
+
+    from manim import tempconfig
+
+    # Record manim's log so the parent can break the job down into stages
+    recorder = _LogRecorder()
+    manim_logger = logging.getLogger("manim")
+    previous_level = manim_logger.level
+    manim_logger.setLevel(logging.DEBUG)
+    manim_logger.addHandler(recorder)
+
+    media_dir = tempfile.mkdtemp(prefix="manim_media_")
+    try:
+        settings = dict(QUALITY_PRESETS[quality], media_dir=media_dir, progress_bar="none")
+        if animation_range:
+            # Same as the CLI's `-n start,end` (an end of None renders to the end of the scene)
+            settings["from_animation_number"] = animation_range[0]
+            if animation_range[1] is not None:
+                settings["upto_animation_number"] = animation_range[1]
+        settings.update(extra_config or {})
+        with tempconfig(settings):
+            # Load the scene file under a unique name so jobs never see each other's classes
+            spec = importlib.util.spec_from_file_location(f"render_job_{uuid.uuid4().hex}", scene_file)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+
+            scene = getattr(module, scene_name)()
+            scene.render()
+            movie_file = str(scene.renderer.file_writer.movie_file_path)
+
+        shutil.move(movie_file, output_file)
+        return output_file, recorder.events, time.perf_counter() - recorder.start
+
+    finally:
+        manim_logger.removeHandler(recorder)
+        manim_logger.setLevel(previous_level)
+        shutil.rmtree(media_dir, ignore_errors=True)
+
+# Stages of a render, in the order they happen
+RENDER_STAGES = ("clean", "write", "startup", "tex", "frames", "encode")
+
+# manim logs this (at INFO) right before compiling a new LaTeX string
+TEX_LOG_PATTERN = re.compile(r"Writing .* to .*\.tex")
+
+def parse_manim_log(events: List[Tuple[float, str]], total: float, startup: float = None) -> Dict[str, float]:
+    """
+    Attribute a manim run's wall time to startup, tex, frames and encode stages.
+
+    Args:
+        events: (seconds since launch, log line) pairs
+        total: Seconds from launch until manim finished
+        startup: Known startup time; by default the time until manim's first log line,
+            which also absorbs any scene setup done before it
+
+    Returns:
+        Dict[str, float]: Seconds spent in each stage
+    """
+    if startup is None:
+        startup = events[0][0] if events else total
+
+    tex = 0.0
+    encode = 0.0
+    for i, (timestamp, line) in enumerate(events):
+        if "Combining to Movie file" in line:
+            # Everything after this is ffmpeg concatenating and muxing partial movies
+            encode = total - timestamp
+            break
+        if TEX_LOG_PATTERN.search(line):
+            # LaTeX runs between this line and whatever manim logs next
+            next_timestamp = events[i + 1][0] if i + 1 < len(events) else total
+            tex += next_timestamp - timestamp
+
+    return {
+        "startup": startup,
+        "tex": tex,
+        "frames": max(0.0, total - startup - tex - encode),
+        "encode": encode
+    }
+
+class RenderTimingHistogram:
+    """
+    Aggregates per-stage render timings into log-spaced histogram buckets.
+    """
+
+    # Upper bounds (seconds) of each bucket; the last one catches everything else
+    BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, math.inf)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.renders = 0
+        self.cache_hits = 0
+        self.counts = {stage: [0] * len(self.BUCKETS) for stage in RENDER_STAGES + ("total",)}
+        self.sums = {stage: 0.0 for stage in self.counts}
+
+    def add(self, timings: Dict[str, float]):
+        """Record one render's timing breakdown."""
+        with self._lock:
+            self.renders += 1
+            self.cache_hits += bool(timings.get("cache_hit"))
+            for stage in self.counts:
+                seconds = timings.get(stage, 0.0)
+                bucket = next(i for i, bound in enumerate(self.BUCKETS) if seconds <= bound)
+                self.counts[stage][bucket] += 1
+                self.sums[stage] += seconds
+
+    def to_dict(self) -> Dict:
+        """Summarize the histogram as plain JSON-serializable data."""
+        with self._lock:
+            return {
+                "renders": self.renders,
+                "cache_hits": self.cache_hits,
+                "bucket_upper_bounds": [str(bound) if math.isinf(bound) else bound for bound in self.BUCKETS],
+                "stages": {
+                    stage: {
+                        "counts": list(self.counts[stage]),
+                        "total_seconds": self.sums[stage],
+                        "mean_seconds": self.sums[stage] / self.renders if self.renders else 0.0
+                    }
+                    for stage in self.counts
+                }
+            }
+
+    def dump_json(self, path: str) -> str:
+        """Write the histogram to a JSON file."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return path
+
+# Every generate_video_from_code call is recorded here
+render_timing_histogram = RenderTimingHistogram()
+
+class RenderPool:
+    """
+    Pool of pre-forked render workers that already have manim imported.
+
+    Workers are recycled after `max_jobs_per_worker` renders so memory leaked by
+    scene code (or manim itself) doesn't accumulate. A render that exceeds
+    `render_timeout` has its worker killed; the pool starts a fresh one in its place.
+    """
+
+    def __init__(self, size: int = None, max_jobs_per_worker: int = 20, render_timeout: float = None):
+        self.size = size or os.cpu_count() or 1
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.render_timeout = render_timeout
+
+        # forkserver lets recycled workers fork from a process that has manim preloaded
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["manim"])
+        else:
+            context = multiprocessing.get_context("spawn")
+
+        # Jobs report (job id, worker pid) here when they start, so a stuck job's worker can be killed
+        self._job_started_queue = context.SimpleQueue()
+        self._job_pids = {}
+        self._job_pids_lock = threading.Lock()
+
+        self._pool = context.Pool(
+            processes=self.size,
+            initializer=_init_render_worker,
+            initargs=(self._job_started_queue,),
+            maxtasksperchild=max_jobs_per_worker
+        )
+
+    def submit(self, scene_file: str, scene_name: str, output_file: str, quality: str = "h",
+               animation_range: Tuple[int, int] = None, extra_config: Dict[str, str] = None,
+               job_id: str = None, deadline: float = None):
+        """
+        Queue a render and return the pool's AsyncResult.
+        """
+        return self._pool.apply_async(
+            _render_in_worker,
+            (scene_file, scene_name, output_file, quality, animation_range, extra_config, job_id, deadline)
+        )
+
+    def _worker_pid(self, job_id: str) -> int:
+        """Return the pid of the worker that picked up `job_id` (None if it hasn't started)."""
+        with self._job_pids_lock:
+            while not self._job_started_queue.empty():
+                started_job, pid = self._job_started_queue.get()
+                self._job_pids[started_job] = pid
+            return self._job_pids.pop(job_id, None)
+
+    def _kill_job(self, job_id: str, result):
+        """Kill the worker stuck on `job_id`; the pool replaces dead workers on its own."""
+        pid = self._worker_pid(job_id)
+        if pid is None or result.ready():
+            return
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def render(self, scene_file: str, scene_name: str, output_file: str, quality: str = "h",
+               animation_range: Tuple[int, int] = None, extra_config: Dict[str, str] = None,
+               timings: Dict[str, float] = None) -> str:
+        """
+        Render a scene file on a warm worker.
+
+        Args:
+            animation_range (Tuple[int, int]): Only render animations start..end (inclusive; end None for all the rest)
+            extra_config (Dict[str, str]): Additional manim config overrides for this render
+            timings (Dict[str, float]): If given, filled with the render's stage breakdown
+
+        Returns:
+            str: Path to the generated video, or None if rendering failed
+        """
+        started = time.perf_counter()
+        job_id = uuid.uuid4().hex
+        deadline = time.time() + self.render_timeout if self.render_timeout is not None else None
+        try:
+            result = self.submit(scene_file, scene_name, output_file, quality, animation_range, extra_config,
+                                 job_id, deadline)
+            try:
+                video_path, events, job_seconds = result.get(self.render_timeout)
+            except multiprocessing.TimeoutError:
+                self._kill_job(job_id, result)
+                raise
+            finally:
+                self._worker_pid(job_id)  # Drop the finished job's pid
+
+            if timings is not None:
+                # Waiting for a free worker is this path's equivalent of interpreter startup
+                total = time.perf_counter() - started
+                waited = max(0.0, total - job_seconds)
+                timings.update(parse_manim_log([(t + waited, line) for t, line in events], total, startup=waited))
+
+            return video_path
+        except multiprocessing.TimeoutError:
+            print(f"Error generating video: render timed out after {self.render_timeout}s")
+            return None
+        except Exception as e:
+            print(f"Error generating video: {e}")
+            return None
+
+    def close(self):
+        """
+        Stop accepting jobs and wait for the workers to exit.
+
+        With a render timeout set, workers still busy that long after closing are
+        terminated instead of waited on. This also ends the wait when an earlier job
+        was killed, since the pool never hears back about killed jobs.
+        """
+        self._pool.close()
+        joiner = threading.Thread(target=self._pool.join, daemon=True)
+        joiner.start()
+        joiner.join(self.render_timeout)
+        if joiner.is_alive():
+            self._pool.terminate()
+            joiner.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def _link_or_copy(source: str, destination: str):
+    """Hard-link a file when possible (instant, no extra disk), otherwise copy it."""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+class RenderCache:
+    """
+    Persistent, content-addressed cache of rendered videos.
+
+    Entries are keyed on the AST of the cleaned code (so comments and formatting
+    don't matter), the scene name and the quality flag. The least recently used
+    videos are evicted once the cache grows past `max_bytes`.
+    """
+
+    def __init__(self, cache_dir: str = "render_cache", max_bytes: int = 5 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, code: str, scene_name: str, quality: str) -> str:
+        """
+        Hash the normalized code, scene name and quality. Returns None for code that doesn't parse.
+        """
+        try:
+            normalized = ast.dump(ast.parse(code))
+        except SyntaxError:
+            return None
+
+        digest = hashlib.sha256()
+        for part in (normalized, scene_name, quality):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.mp4")
+
+    def get(self, key: str) -> str:
+        """
+        Look up a rendered video. Returns its path in the cache, or None on a miss.
+        """
+        path = self._path(key) if key else None
+        if path and os.path.exists(path):
+            # Bump the mtime so eviction treats this entry as recently used
+            os.utime(path)
+            self.hits += 1
+            return path
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, video_path: str) -> str:
+        """
+        Store a rendered video under `key` and evict old entries if over budget.
+        """
+        if not key:
+            return None
+
+        path = self._path(key)
+        # Write under a temporary name first so readers never see a partial file
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        _link_or_copy(video_path, temp_path)
+        os.replace(temp_path, path)
+
+        self.evict()
+        return path
+
+    def evict(self):
+        """Remove least recently used videos until the cache fits in `max_bytes`."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".mp4"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+    def stats(self) -> dict:
+        """Return hit/miss counters for this cache instance."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+# Shared across renders and the dataset validator; override with MANIM_TEX_CACHE_DIR
+DEFAULT_TEX_CACHE_DIR = os.getenv(
+    "MANIM_TEX_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "3b1b", "tex_cache")
+)
+
+def scene_strings(code: str) -> List[str]:
+    """
+    Return the string constants passed positionally to calls in `code` (MathTex, Text, ...).
+
+    These are what decide which cached tex/text SVGs a scene can reuse.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return []
+
+    strings = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            for arg in node.args:
+                if isinstance(arg, ast.Constant) and isinstance(arg.value, str) and arg.value.strip():
+                    strings.add(arg.value)
+    return sorted(strings)
+
+def scene_file_strings(scene_file: str) -> List[str]:
+    """scene_strings for a scene file on disk."""
+    with open(scene_file, encoding="utf-8") as f:
+        return scene_strings(f.read())
+
+class TexCache:
+    """
+    Persistent cache of compiled LaTeX (MathTex/Tex) and rasterized Text SVGs.
+
+    manim names these SVGs after a hash of their content, so they can be reused
+    across runs. Each render gets a private scratch directory, so concurrent
+    renders never write into each other's files; SVGs compiled during the render
+    are published back with an atomic link. The scratch directory is only seeded
+    with the SVGs indexed under the scene's strings (see scene_strings); anything
+    missed is simply recompiled. Once the cache has grown by `evict_every_bytes`,
+    or `evict_interval` seconds after something was published, the oldest entries
+    are evicted down to `max_bytes`.
+    """
+
+    # manim config keys for the two caches -> their directory under cache_dir
+    CACHE_DIRS = {"tex_dir": "Tex", "text_dir": "texts"}
+
+    def __init__(self, cache_dir: str = DEFAULT_TEX_CACHE_DIR, max_bytes: int = 2 * 1024 ** 3,
+                 evict_every_bytes: int = None, evict_interval: float = 600):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.evict_every_bytes = evict_every_bytes or max_bytes // 20
+        self.evict_interval = evict_interval
+        self._lock = threading.Lock()
+        self._published_bytes = 0
+        self._last_evict = time.monotonic()
+        for subdir in list(self.CACHE_DIRS.values()) + ["scratch", "index"]:
+            os.makedirs(os.path.join(cache_dir, subdir), exist_ok=True)
+
+    def _index_file(self, string: str) -> str:
+        return os.path.join(self.cache_dir, "index", hashlib.sha256(string.encode("utf-8")).hexdigest()[:32])
+
+    def lookup(self, strings: List[str]) -> List[str]:
+        """Return the cached SVGs ("<subdir>/<name>") indexed under any of `strings`."""
+        entries = set()
+        for string in strings:
+            try:
+                with open(self._index_file(string), encoding="utf-8") as f:
+                    entries.update(line.strip() for line in f if line.strip())
+            except FileNotFoundError:
+                continue
+        return sorted(entries)
+
+    @contextmanager
+    def scratch(self, strings: List[str] = None):
+        """
+        Yield manim config overrides ({"tex_dir": ..., "text_dir": ...}) pointing at a
+        private scratch directory seeded with the SVGs indexed under `strings`, and
+        publish new SVGs back (indexed under the same strings) when done.
+        """
+        strings = strings or []
+        scratch_dir = tempfile.mkdtemp(dir=os.path.join(self.cache_dir, "scratch"))
+        overrides = {}
+        try:
+            for key, subdir in self.CACHE_DIRS.items():
+                overrides[key] = os.path.join(scratch_dir, subdir)
+                os.makedirs(overrides[key])
+
+            for entry in self.lookup(strings):
+                subdir, name = os.path.split(entry)
+                if subdir not in self.CACHE_DIRS.values():
+                    continue
+                key = next(key for key, cache_subdir in self.CACHE_DIRS.items() if cache_subdir == subdir)
+                try:
+                    _link_or_copy(os.path.join(self.cache_dir, entry), os.path.join(overrides[key], name))
+                except FileNotFoundError:
+                    # Evicted since it was indexed
+                    pass
+
+            yield overrides
+
+        finally:
+            self.publish(overrides, strings)
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+            self.maybe_evict()
+
+    def publish(self, overrides: Dict[str, str], strings: List[str] = None):
+        """Move SVGs from a scratch directory into the shared cache and index them under `strings`."""
+        index = {}
+        published_bytes = 0
+        for key, scratch_subdir in overrides.items():
+            shared_dir = os.path.join(self.cache_dir, self.CACHE_DIRS[key])
+            for name in os.listdir(scratch_subdir):
+                if not name.endswith(".svg") or os.path.exists(os.path.join(shared_dir, name)):
+                    continue
+                # Link under a temporary name, then rename, so readers never see a partial SVG
+                temp_path = os.path.join(shared_dir, f".{name}.{uuid.uuid4().hex}.tmp")
+                _link_or_copy(os.path.join(scratch_subdir, name), temp_path)
+                os.replace(temp_path, os.path.join(shared_dir, name))
+                published_bytes += os.path.getsize(os.path.join(shared_dir, name))
+
+                # LaTeX SVGs have their .tex source alongside, so only index the strings it contains;
+                # Text SVGs have no source and are indexed under all of them
+                source = os.path.join(scratch_subdir, name[:-len(".svg")] + ".tex")
+                matching = strings or []
+                if os.path.exists(source):
+                    with open(source, encoding="utf-8", errors="replace") as f:
+                        body = f.read().split("\\begin{document}")[-1]
+                    matching = [string for string in matching if string in body]
+                for string in matching:
+                    index.setdefault(string, []).append(f"{self.CACHE_DIRS[key]}/{name}")
+
+        for string, entries in index.items():
+            # One short append per string, so concurrent publishers don't interleave lines
+            with open(self._index_file(string), "a", encoding="utf-8") as f:
+                f.write("".join(f"{entry}\n" for entry in entries))
+
+        with self._lock:
+            self._published_bytes += published_bytes
+
+    def touch(self, names: List[str]):
+        """Mark SVGs as recently used so eviction keeps them."""
+        for subdir in self.CACHE_DIRS.values():
+            for name in names:
+                path = os.path.join(self.cache_dir, subdir, name)
+                if os.path.exists(path):
+                    os.utime(path)
+
+    def maybe_evict(self):
+        """Evict once enough has been published, or a while after anything was published."""
+        with self._lock:
+            due = self._published_bytes >= self.evict_every_bytes or (
+                self._published_bytes > 0 and time.monotonic() - self._last_evict >= self.evict_interval
+            )
+            if not due:
+                return
+            self._published_bytes = 0
+            self._last_evict = time.monotonic()
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently published or touched SVGs until the cache fits in `max_bytes`."""
+        entries = []
+        for subdir in self.CACHE_DIRS.values():
+            shared_dir = os.path.join(self.cache_dir, subdir)
+            for name in os.listdir(shared_dir):
+                try:
+                    stat = os.stat(os.path.join(shared_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(shared_dir, name)))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+_shared_tex_cache = None
+
+def get_shared_tex_cache() -> TexCache:
+    """Return the process-wide TexCache in DEFAULT_TEX_CACHE_DIR, creating it on first use."""
+    global _shared_tex_cache
+    if _shared_tex_cache is None:
+        _shared_tex_cache = TexCache()
+    return _shared_tex_cache
+
+def write_manim_config(overrides: Dict[str, str], config_file: str) -> str:
+    """Write config overrides to a manim.cfg file for the CLI's --config_file option."""
+    with open(config_file, "w") as f:
+        f.write("[CLI]\n")
+        for key, value in overrides.items():
+            f.write(f"{key} = {value}\n")
+    return config_file
+
+def extract_code_blocks(text: str) -> List[str]:
+    """
+    Pull Python code out of a model response or dataset entry.
+
+    Returns the text itself if it already parses as Python, otherwise the
+    contents of its fenced code blocks.
+    """
+    text = text.split("</think>")[-1]
+    try:
+        ast.parse(text)
+        return [text]
+    except SyntaxError:
+        pass
+    return [block.strip() for block in re.findall(r"```(?:python|py)?[^\n]*\n(.*?)```", text, re.DOTALL)]
+
+# Tex classes whose strings are worth compiling ahead of time, and kwargs that
+# change the compiled output (calls using them are skipped)
+PREWARM_TEX_CLASSES = ("MathTex", "Tex")
+PREWARM_SKIP_KWARGS = {"tex_template", "tex_environment", "arg_separator"}
+
+def collect_tex_strings(paths: List[str]) -> Counter:
+    """
+    Count constant MathTex/Tex calls across dataset JSON files and model responses.
+
+    Returns:
+        Counter: (class name, tuple of string args) -> number of occurrences
+    """
+    def iter_texts(value):
+        if isinstance(value, str):
+            yield value
+        elif isinstance(value, dict):
+            for item in value.values():
+                yield from iter_texts(item)
+        elif isinstance(value, list):
+            for item in value:
+                yield from iter_texts(item)
+
+    counts = Counter()
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                raw = f.read()
+            texts = list(iter_texts(json.loads(raw))) if path.endswith(".json") else [raw]
+        except (OSError, ValueError) as e:
+            print(f"Skipping {path}: {e}")
+            continue
+
+        for text in texts:
+            if "Tex" not in text:
+                continue
+            for block in extract_code_blocks(text):
+                try:
+                    tree = ast.parse(block)
+                except SyntaxError:
+                    continue
+                for node in ast.walk(tree):
+                    if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                            and node.func.id in PREWARM_TEX_CLASSES and node.args):
+                        continue
+                    if any(keyword.arg in PREWARM_SKIP_KWARGS for keyword in node.keywords):
+                        continue
+                    if all(isinstance(arg, ast.Constant) and isinstance(arg.value, str) for arg in node.args):
+                        counts[(node.func.id, tuple(arg.value for arg in node.args))] += 1
+
+    return counts
+
+def _compile_tex_strings(tex_calls: List[Tuple[str, Tuple[str, ...]]], overrides: Dict[str, str]) -> int:
+    """Instantiate Tex mobjects so manim compiles their SVGs. Runs in a worker process."""
+    import manim
+
+    compiled = 0
+    with manim.tempconfig(overrides):
+        for class_name, args in tex_calls:
+            try:
+                getattr(manim, class_name)(*args)
+                compiled += 1
+            except Exception as e:
+                print(f"Could not compile {class_name}{args}: {e}")
+    return compiled
+
+def prewarm_tex_cache(paths: List[str], top_n: int = 500, tex_cache: TexCache = None, workers: int = None) -> int:
+    """
+    Compile the most common MathTex/Tex strings from `paths` into the shared tex cache.
+
+    Returns:
+        int: Number of strings compiled (or already cached)
+    """
+    tex_cache = tex_cache or get_shared_tex_cache()
+    most_common = [call for call, _ in collect_tex_strings(paths).most_common(top_n)]
+    if not most_common:
+        print("No MathTex/Tex strings found to prewarm")
+        return 0
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(most_common)))
+    chunks = [most_common[i::workers] for i in range(workers)]
+
+    with tex_cache.scratch([string for _, args in most_common for string in args]) as overrides:
+        # One scratch directory is fine here: manim writes each hash to its own file
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            compiled = sum(executor.map(_compile_tex_strings, chunks, [overrides] * workers))
+
+        # Keep the popular entries at the front of the eviction queue
+        for subdir in overrides.values():
+            tex_cache.touch([name for name in os.listdir(subdir) if name.endswith(".svg")])
+
+    print(f"Prewarmed {compiled}/{len(most_common)} tex strings into {tex_cache.cache_dir}")
+    return compiled
 
 def clean_manim_code(code: str) -> str:
     """
@@ -9,62 +742,958 @@ def clean_manim_code(code: str) -> str:
     # Remove think tags and their content
     if "<think>" in code:
         code = code.split("</think>")[-1]
-    
+
     # Ensure the code starts with imports
     if not code.strip().startswith("from manim import"):
         code = "from manim import *\n\n" + code
-    
+
     return code
 
-def generate_video_from_code(code: str, output_dir: str = "videos") -> str:
+# Base classes that mark a class as a renderable scene
+SCENE_BASE_CLASSES = ("Scene", "MovingCameraScene", "ThreeDScene")
+
+def find_scene_classes(code: str) -> List[str]:
+    """
+    Find every Scene, MovingCameraScene or ThreeDScene subclass defined at module level.
+
+    Classes deriving from another scene class in the same file are included too.
+    Returns the class names in source order, or an empty list if the code doesn't parse.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return []
+
+    scene_bases = set(SCENE_BASE_CLASSES)
+    scene_classes = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+
+        for base in node.bases:
+            # Handles both `Scene` and `manim.Scene`
+            base_name = base.id if isinstance(base, ast.Name) else getattr(base, "attr", None)
+            if base_name in scene_bases:
+                scene_classes.append(node.name)
+                scene_bases.add(node.name)
+                break
+
+    return scene_classes
+
+# Coefficients (seconds per unit of each feature) of the linear render cost model.
+# Rough, unfitted defaults for the manim CLI; fit real ones with calibrate_render_cost() on
+# measured renders and point MANIM_RENDER_COST_MODEL at the saved file to use them by default.
+RENDER_COST_MODEL_PATH = os.getenv("MANIM_RENDER_COST_MODEL")
+DEFAULT_RENDER_COST_COEFFICIENTS = {
+    "intercept": 4.0,            # interpreter startup, imports and scene setup
+    "play_calls": 0.25,          # per-animation overhead (hashing, partial movie files)
+    "frame_seconds": 0.5,        # animated seconds, scaled by resolution x frame rate relative to -qh
+    "three_d_frame_seconds": 1.5,  # extra per frame-second for ThreeDScene rendering
+    "updater_frame_seconds": 0.05,  # updaters/always_redraw re-run every frame
+    "surface_frame_seconds": 0.4,  # per 1000 surface/curve sample points per frame-second
+    "tex_objects": 0.6,          # LaTeX compiles (cache misses)
+    "text_objects": 0.05,        # Pango text rendering (Text, MarkupText, Integer, ...)
+    "loop_mobjects": 0.01,       # mobjects built in loops
+}
+
+# Assumed iterations for loops whose bounds aren't literal
+DEFAULT_LOOP_ITERATIONS = 5
+
+TEX_CLASSES = ("MathTex", "Tex", "SingleStringMathTex", "Title", "BulletedList")
+TEXT_CLASSES = ("Text", "MarkupText", "Paragraph", "DecimalNumber", "Integer")
+SURFACE_CLASSES = ("Surface", "ParametricSurface", "OpenGLSurface")
+CURVE_CLASSES = ("ParametricFunction", "FunctionGraph", "ImplicitFunction")
+
+def _literal(node):
+    """Return the value of a literal AST node, or None if it isn't one."""
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _loop_iterations(node) -> int:
+    """Guess how many times a for loop (or comprehension generator) iterates."""
+    iterable = node.iter
+    if isinstance(iterable, ast.Call) and isinstance(iterable.func, ast.Name) and iterable.func.id == "range":
+        bounds = [_literal(arg) for arg in iterable.args]
+        if 1 <= len(bounds) <= 3 and all(isinstance(bound, int) for bound in bounds):
+            try:
+                return len(range(*bounds))
+            except ValueError:
+                # range() with a zero step raises when the scene runs; don't guess its cost
+                return DEFAULT_LOOP_ITERATIONS
+    values = _literal(iterable)
+    if isinstance(values, (list, tuple, str)):
+        return len(values)
+    if isinstance(iterable, (ast.List, ast.Tuple)):
+        return len(iterable.elts)
+    return DEFAULT_LOOP_ITERATIONS
+
+def _call_name(node) -> str:
+    """Name of the called function or method (`Circle` for Circle(), `play` for self.play())."""
+    if isinstance(node.func, ast.Name):
+        return node.func.id
+    if isinstance(node.func, ast.Attribute):
+        return node.func.attr
+    return None
+
+def _keyword(node, name: str):
+    return next((keyword.value for keyword in node.keywords if keyword.arg == name), None)
+
+def _base_name(base) -> str:
+    """Name of a base class expression (`Scene` for Scene, `ThreeDScene` for manim.ThreeDScene)."""
+    return base.id if isinstance(base, ast.Name) else getattr(base, "attr", None)
+
+def _scene_methods(tree, scene_name: str) -> Dict[str, ast.FunctionDef]:
+    """
+    Methods of the class `scene_name`, including ones inherited from classes defined in
+    the same file (nearest definition wins, breadth first like a simple MRO).
+    """
+    classes = {node.name: node for node in tree.body if isinstance(node, ast.ClassDef)}
+    methods = {}
+    pending = [scene_name]
+    seen = set()
+    while pending:
+        name = pending.pop(0)
+        if name in seen or name not in classes:
+            continue
+        seen.add(name)
+        for item in classes[name].body:
+            if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                methods.setdefault(item.name, item)
+        pending.extend(_base_name(base) for base in classes[name].bases)
+    return methods
+
+def render_cost_features(code: str, scene_name: str = None, quality: str = "h") -> Dict[str, float]:
+    """
+    Statically extract render cost features from a scene with ast.
+
+    Calls inside loops are weighted by the loop's (literal or guessed) iteration count.
+    Methods inherited from classes defined in the same file are included, so
+    `class B(A): pass` costs as much as A.
+
+    Returns:
+        Dict[str, float]: Feature values keyed like DEFAULT_RENDER_COST_COEFFICIENTS,
+            or None if the code doesn't parse or has no such scene
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+
+    scene_classes = find_scene_classes(code)
+    scene_name = scene_name or (scene_classes[0] if scene_classes else None)
+    scene = next((node for node in tree.body if isinstance(node, ast.ClassDef) and node.name == scene_name), None)
+    if scene is None:
+        return None
+
+    # Walk the scene's own chain of base classes in this file to spot ThreeDScene
+    classes = {node.name: node for node in tree.body if isinstance(node, ast.ClassDef)}
+    is_three_d = False
+    pending = [scene]
+    while pending:
+        for base in pending.pop().bases:
+            base_name = _base_name(base)
+            if base_name == "ThreeDScene":
+                is_three_d = True
+            elif base_name in classes:
+                pending.append(classes[base_name])
+
+    totals = {
+        "play_calls": 0.0, "animated_seconds": 0.0, "updaters": 0.0, "surface_points": 0.0,
+        "tex_objects": 0.0, "text_objects": 0.0, "loop_mobjects": 0.0
+    }
+
+    def visit(node, multiplier, in_play):
+        if isinstance(node, (ast.For, ast.AsyncFor)):
+            multiplier *= _loop_iterations(node)
+        elif isinstance(node, (ast.ListComp, ast.SetComp, ast.GeneratorExp, ast.DictComp)):
+            for generator in node.generators:
+                multiplier *= _loop_iterations(generator)
+        elif isinstance(node, ast.While):
+            multiplier *= DEFAULT_LOOP_ITERATIONS
+
+        if isinstance(node, ast.Call):
+            name = _call_name(node)
+            if name == "play":
+                totals["play_calls"] += multiplier
+                # A play lasts as long as its longest run_time (manim's default is 1s)
+                run_times = [_literal(child.value) for child in ast.walk(node)
+                             if isinstance(child, ast.keyword) and child.arg == "run_time"]
+                run_times = [value for value in run_times if _is_number(value)]
+                totals["animated_seconds"] += multiplier * max(run_times + [1.0])
+                in_play = True
+            elif name in ("wait", "pause"):
+                totals["play_calls"] += multiplier
+                duration = _literal(node.args[0]) if node.args else _literal(_keyword(node, "duration"))
+                totals["animated_seconds"] += multiplier * (duration if _is_number(duration) else 1.0)
+            elif name in ("add_updater", "always_redraw"):
+                totals["updaters"] += multiplier
+            elif name in SURFACE_CLASSES:
+                resolution = _literal(_keyword(node, "resolution")) if _keyword(node, "resolution") else None
+                if _is_number(resolution):
+                    points = resolution * resolution
+                elif (isinstance(resolution, (list, tuple)) and len(resolution) == 2
+                      and all(_is_number(value) for value in resolution)):
+                    points = resolution[0] * resolution[1]
+                else:
+                    points = 32 * 32  # manim's default Surface resolution
+                totals["surface_points"] += multiplier * points
+            elif name in CURVE_CLASSES:
+                t_range = _literal(_keyword(node, "t_range")) if _keyword(node, "t_range") else None
+                if (isinstance(t_range, (list, tuple)) and len(t_range) == 3
+                        and all(_is_number(value) for value in t_range) and t_range[2]):
+                    points = abs((t_range[1] - t_range[0]) / t_range[2])
+                else:
+                    points = 100
+                totals["surface_points"] += multiplier * points
+
+            if name in TEX_CLASSES:
+                totals["tex_objects"] += multiplier
+            elif name in TEXT_CLASSES:
+                totals["text_objects"] += multiplier
+            elif name and name[0].isupper() and multiplier > 1 and not in_play:
+                # Constructors outside play() calls are mostly mobjects
+                totals["loop_mobjects"] += multiplier
+
+        for child in ast.iter_child_nodes(node):
+            visit(child, multiplier, in_play)
+
+    for method in _scene_methods(tree, scene_name).values():
+        visit(method, 1, False)
+
+    preset = QUALITY_PRESETS[quality]
+    high = QUALITY_PRESETS["h"]
+    frame_scale = (preset["pixel_height"] * preset["pixel_width"] * preset["frame_rate"]) / (
+        high["pixel_height"] * high["pixel_width"] * high["frame_rate"]
+    )
+    frame_seconds = totals["animated_seconds"] * frame_scale
+
+    return {
+        "play_calls": totals["play_calls"],
+        "animated_seconds": totals["animated_seconds"],
+        "frame_seconds": frame_seconds,
+        "three_d_frame_seconds": frame_seconds if is_three_d else 0.0,
+        "updater_frame_seconds": totals["updaters"] * frame_seconds,
+        "surface_frame_seconds": totals["surface_points"] / 1000 * frame_seconds,
+        "tex_objects": totals["tex_objects"],
+        "text_objects": totals["text_objects"],
+        "loop_mobjects": totals["loop_mobjects"],
+    }
+
+def estimate_render_cost(code: str, scene_name: str = None, quality: str = "h",
+                         coefficients: Dict[str, float] = None) -> Dict:
+    """
+    Estimate how long a scene will take to render, without running it.
+
+    Args:
+        code (str): The (cleaned) Manim code
+        scene_name (str): Scene class to estimate; defaults to the first scene found in the code
+        quality (str): Manim quality flag the scene would be rendered at
+        coefficients (Dict[str, float]): Cost model; defaults to the calibrated model at
+            MANIM_RENDER_COST_MODEL if set, otherwise DEFAULT_RENDER_COST_COEFFICIENTS
+
+    Returns:
+        Dict: {"seconds": estimated render seconds, "features": feature values},
+            or None if the code doesn't parse or has no scene
+    """
+    features = render_cost_features(code, scene_name, quality)
+    if features is None:
+        return None
+
+    if coefficients is None:
+        coefficients = (load_render_cost_model(RENDER_COST_MODEL_PATH) if RENDER_COST_MODEL_PATH
+                        else DEFAULT_RENDER_COST_COEFFICIENTS)
+    seconds = coefficients.get("intercept", 0.0) + sum(
+        coefficients.get(name, 0.0) * value for name, value in features.items()
+    )
+    return {"seconds": seconds, "features": features}
+
+def calibrate_render_cost(samples: List[Dict], output_path: str = None) -> Dict[str, float]:
+    """
+    Fit the cost model's coefficients to measured renders with least squares.
+
+    Args:
+        samples (List[Dict]): Measured renders as {"code", "seconds", optional "quality", optional "scene_name"}
+        output_path (str): If given, save the fitted coefficients there as JSON
+
+    Returns:
+        Dict[str, float]: Fitted coefficients (negative fits are clamped to 0)
+    """
+    import numpy as np
+
+    names = [name for name in DEFAULT_RENDER_COST_COEFFICIENTS if name != "intercept"]
+    rows = []
+    targets = []
+    for sample in samples:
+        features = render_cost_features(sample["code"], sample.get("scene_name"), sample.get("quality", "h"))
+        if features is not None:
+            rows.append([1.0] + [features[name] for name in names])
+            targets.append(sample["seconds"])
+
+    if len(rows) <= len(names):
+        print(f"Need more than {len(names)} usable samples to calibrate, got {len(rows)}")
+        return dict(DEFAULT_RENDER_COST_COEFFICIENTS)
+
+    solution, *_ = np.linalg.lstsq(np.array(rows), np.array(targets), rcond=None)
+    coefficients = {name: max(0.0, float(value)) for name, value in zip(["intercept"] + names, solution)}
+
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(coefficients, f, indent=2)
+    return coefficients
+
+def load_render_cost_model(path: str) -> Dict[str, float]:
+    """Load coefficients saved by calibrate_render_cost, falling back to the defaults."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return dict(DEFAULT_RENDER_COST_COEFFICIENTS, **json.load(f))
+    except (OSError, ValueError):
+        return dict(DEFAULT_RENDER_COST_COEFFICIENTS)
+
+def _new_job_id() -> str:
+    """Timestamp-based id, suffixed so concurrent renders don't collide."""
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+def _render_uncached(scene_file: str, scene_name: str, output_file: str, quality: str, pool: RenderPool = None,
+                     animation_range: Tuple[int, int] = None, timings: Dict[str, float] = None) -> str:
+    """
+    Render a scene on the warm pool if given, otherwise with the manim CLI.
+    Either way the render reads and fills the shared tex cache. If `timings` is
+    given it is filled with the startup/tex/frames/encode breakdown.
+
+    Returns:
+        str: Path to the generated video, or None if rendering failed
+    """
+    with get_shared_tex_cache().scratch(scene_file_strings(scene_file)) as tex_dirs:
+        if pool is not None:
+            return pool.render(os.path.abspath(scene_file), scene_name, output_file, quality, animation_range,
+                               tex_dirs, timings)
+
+        scratch_dir = os.path.dirname(tex_dirs["tex_dir"])
+        config_file = write_manim_config(tex_dirs, os.path.join(scratch_dir, "manim.cfg"))
+
+        # Run manim command to render the video
+        command = [
+            "manim",
+            f"-q{quality}",  # Render quality
+            "-o", os.path.abspath(output_file),  # Output file (absolute so manim doesn't nest it under media/)
+            "--media_dir", os.path.join(scratch_dir, "media"),  # Private partial movie files, so parallel segments don't clash
+            "--config_file", config_file,  # Points tex/text caches at the shared cache
+            "-v", "DEBUG",  # Finer-grained log lines for the timing breakdown
+        ]
+        if animation_range:
+            # Only render this animation range (to the end of the scene if it has no end)
+            start, end = animation_range
+            command += ["-n", f"{start},{end}" if end is not None else f"{start}"]
+        command += [
+            scene_file,  # Input file
+            scene_name  # Scene class name
+        ]
+
+        # Timestamp manim's output line by line as it arrives; a wide COLUMNS keeps rich from wrapping lines
+        started = time.perf_counter()
+        events = []
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                   env=dict(os.environ, COLUMNS="1000"))
+        for line in process.stdout:
+            events.append((time.perf_counter() - started, line))
+            if "DEBUG" not in line:
+                print(line, end="")
+        returncode = process.wait()
+
+        if timings is not None:
+            timings.update(parse_manim_log(events, time.perf_counter() - started))
+
+        if returncode != 0:
+            print(f"Error generating video: {subprocess.CalledProcessError(returncode, command)}")
+            return None
+        return output_file
+
+def _render_scene(cleaned_code: str, scene_file: str, scene_name: str, output_file: str, quality: str,
+                  pool: RenderPool = None, cache: RenderCache = None, timings: Dict[str, float] = None) -> str:
+    """
+    Render one scene from an already written scene file, going through the cache if given.
+
+    Returns:
+        str: Path to the generated video, or None if rendering failed
+    """
+    cache_key = cache.key(cleaned_code, scene_name, quality) if cache else None
+    cached_video = cache.get(cache_key) if cache else None
+    if cached_video:
+        _link_or_copy(cached_video, output_file)
+        print(f"Video served from cache: {output_file}")
+        if timings is not None:
+            timings["cache_hit"] = True
+        return output_file
+
+    video_path = _render_uncached(scene_file, scene_name, output_file, quality, pool, timings=timings)
+    if video_path:
+        print(f"Video generated successfully: {video_path}")
+        if cache:
+            cache.put(cache_key, video_path)
+
+    return video_path
+
+def generate_video_from_code(code: str, output_dir: str = "videos", quality: str = "h", pool: RenderPool = None,
+                             cache: RenderCache = None, scene_name: str = None, return_timings: bool = False):
     """
     Generate a video from Manim code.
-    
+
     Args:
         code (str): The Manim code to render
         output_dir (str): Directory to save the video
-        
+        quality (str): Manim quality flag ("l", "m", "h", "p" or "k")
+        pool (RenderPool): Warm worker pool to render on instead of spawning the manim CLI
+        cache (RenderCache): Cache of previous renders to check before rendering
+        scene_name (str): Scene class to render; defaults to the first scene found in the code
+        return_timings (bool): Also return the per-stage timing breakdown
+
     Returns:
-        str: Path to the generated video
+        str: Path to the generated video, or (path, timings) if return_timings is set.
+            timings maps each of RENDER_STAGES (plus "total") to seconds.
     """
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
-    
-    # Generate a unique filename based on timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    temp_file = f"temp_animation_{timestamp}.py"
-    output_file = os.path.join(output_dir, f"animation_{timestamp}.mp4")
-    
+
+    job_id = _new_job_id()
+    temp_file = f"temp_animation_{job_id}.py"
+    output_file = os.path.join(output_dir, f"animation_{job_id}.mp4")
+
+    timings = {stage: 0.0 for stage in RENDER_STAGES}
+    timings["cache_hit"] = False
+    started = time.perf_counter()
+    video_path = None
+
     try:
-        # Clean and write the code to a temporary file
+        # Clean the code and find the scene before launching anything
         cleaned_code = clean_manim_code(code)
+        timings["clean"] = time.perf_counter() - started
+
+        if scene_name is None:
+            scene_classes = find_scene_classes(cleaned_code)
+            scene_name = scene_classes[0] if scene_classes else None
+
+        if scene_name is None:
+            print("Error generating video: no Scene subclass found in code")
+        else:
+            # Write the code to a temporary file
+            write_started = time.perf_counter()
+            with open(temp_file, "w") as f:
+                f.write(cleaned_code)
+            timings["write"] = time.perf_counter() - write_started
+
+            video_path = _render_scene(cleaned_code, temp_file, scene_name, output_file, quality, pool, cache,
+                                       timings)
+
+    finally:
+        # Clean up temporary file
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+    timings["total"] = time.perf_counter() - started
+    render_timing_histogram.add(timings)
+
+    if return_timings:
+        return video_path, timings
+    return video_path
+
+def generate_videos_for_scenes(code: str, output_dir: str = "videos", quality: str = "h", pool: RenderPool = None,
+                               cache: RenderCache = None, max_workers: int = None) -> Dict[str, str]:
+    """
+    Render every scene defined in the code in parallel.
+
+    Args:
+        code (str): The Manim code to render
+        output_dir (str): Directory to save the videos
+        quality (str): Manim quality flag ("l", "m", "h", "p" or "k")
+        pool (RenderPool): Warm worker pool to render on instead of spawning the manim CLI
+        cache (RenderCache): Cache of previous renders to check before rendering
+        max_workers (int): Maximum concurrent renders; defaults to the pool size or CPU count
+
+    Returns:
+        Dict[str, str]: Scene name -> path to its video (None for scenes that failed)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    cleaned_code = clean_manim_code(code)
+    scene_classes = find_scene_classes(cleaned_code)
+    if not scene_classes:
+        print("Error generating video: no Scene subclass found in code")
+        return {}
+
+    job_id = _new_job_id()
+    temp_file = f"temp_animation_{job_id}.py"
+
+    try:
         with open(temp_file, "w") as f:
             f.write(cleaned_code)
-        
-        # Run manim command to render the video
+
+        if max_workers is None:
+            max_workers = pool.size if pool is not None else os.cpu_count() or 1
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(scene_classes))) as executor:
+            futures = {
+                scene_name: executor.submit(
+                    _render_scene, cleaned_code, temp_file, scene_name,
+                    os.path.join(output_dir, f"animation_{job_id}_{scene_name}.mp4"), quality, pool, cache
+                )
+                for scene_name in scene_classes
+            }
+            return {scene_name: future.result() for scene_name, future in futures.items()}
+
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+# Scene methods that advance manim's animation counter (what `-n start,end` indexes)
+ANIMATION_METHODS = ("play", "wait", "pause", "wait_until")
+
+def count_scene_animations(code: str, scene_name: str) -> int:
+    """
+    Estimate how many animations a scene's construct() plays.
+
+    Animation calls inside loops are multiplied by the loop's (literal or guessed)
+    iteration count, a branch counts its larger side, and self.helper() calls count
+    the helper's animations (methods inherited from scenes in the same file
+    included). The result is only an estimate, which is why the last segment
+    planned from it is left open-ended. Returns None if there is no construct().
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+
+    methods = _scene_methods(tree, scene_name)
+    if "construct" not in methods:
+        return None
+
+    def count(node, calling):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+            # Nested definitions don't run where they're defined
+            return 0
+        if isinstance(node, ast.If):
+            return count(node.test, calling) + max(sum(count(child, calling) for child in node.body),
+                                                   sum(count(child, calling) for child in node.orelse))
+        if isinstance(node, (ast.For, ast.AsyncFor, ast.While)):
+            iterations = DEFAULT_LOOP_ITERATIONS if isinstance(node, ast.While) else _loop_iterations(node)
+            header = count(node.test if isinstance(node, ast.While) else node.iter, calling)
+            return header + iterations * sum(count(child, calling) for child in node.body) + sum(
+                count(child, calling) for child in node.orelse)
+        if isinstance(node, (ast.ListComp, ast.SetComp, ast.GeneratorExp, ast.DictComp)):
+            iterations = 1
+            for generator in node.generators:
+                iterations *= _loop_iterations(generator)
+            return iterations * sum(count(child, calling) for child in ast.iter_child_nodes(node)
+                                    if not isinstance(child, ast.comprehension))
+
+        total = sum(count(child, calling) for child in ast.iter_child_nodes(node))
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and isinstance(node.func.value, ast.Name) and node.func.value.id == "self"):
+            name = node.func.attr
+            if name in ANIMATION_METHODS:
+                total += 1
+            elif name in methods and name not in calling:
+                # Follow helper methods, but not into recursion
+                total += sum(count(child, calling | {name}) for child in methods[name].body)
+        return total
+
+    return round(sum(count(statement, {"construct"}) for statement in methods["construct"].body))
+
+def plan_animation_segments(num_animations: int, num_segments: int) -> List[Tuple[int, int]]:
+    """
+    Split animations 0..num_animations-1 into contiguous inclusive ranges for `-n start,end`.
+
+    Every range covers at least two animations: manim treats an end index of 0 as
+    "no limit", and single-animation segments aren't worth a process anyway. The
+    last range's end is None (render to the end of the scene), since
+    num_animations is only an estimate (see count_scene_animations).
+    """
+    num_segments = max(1, min(num_segments, num_animations // 2))
+    size, remainder = divmod(num_animations, num_segments)
+
+    segments = []
+    start = 0
+    for i in range(num_segments):
+        end = start + size + (1 if i < remainder else 0) - 1
+        segments.append((start, end))
+        start = end + 1
+    segments[-1] = (segments[-1][0], None)
+    return segments
+
+def concat_videos(video_files: List[str], output_file: str) -> str:
+    """
+    Stitch videos with ffmpeg's concat demuxer without re-encoding.
+
+    Returns:
+        str: Path to the stitched video, or None if ffmpeg failed
+    """
+    list_file = f"{output_file}.concat.txt"
+    try:
+        with open(list_file, "w") as f:
+            for video_file in video_files:
+                escaped = os.path.abspath(video_file).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+
         command = [
-            "manim",
-            "-qh",  # High quality
-            "-o", output_file,  # Output file
-            temp_file,  # Input file
-            "TransformerArchitecture"  # Scene class name
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", list_file,
+            "-c", "copy",  # Segments share codec settings, so no re-encode is needed
+            output_file
         ]
-        
         subprocess.run(command, check=True)
-        
-        print(f"Video generated successfully: {output_file}")
         return output_file
-        
+
     except subprocess.CalledProcessError as e:
-        print(f"Error generating video: {e}")
+        print(f"Error stitching video segments: {e}")
         return None
-        
+
+    finally:
+        if os.path.exists(list_file):
+            os.remove(list_file)
+
+def generate_video_segmented(code: str, output_dir: str = "videos", quality: str = "h", pool: RenderPool = None,
+                             cache: RenderCache = None, scene_name: str = None, num_segments: int = None) -> str:
+    """
+    Render one long scene as animation ranges in parallel processes, then stitch them.
+
+    Falls back to a regular single-process render when the scene has too few
+    animations to split (see count_scene_animations), or when a segment fails or
+    renders nothing, e.g. because the estimate overshot the real animation count.
+
+    Args:
+        code (str): The Manim code to render
+        output_dir (str): Directory to save the video
+        quality (str): Manim quality flag ("l", "m", "h", "p" or "k")
+        pool (RenderPool): Warm worker pool to render on instead of spawning the manim CLI
+        cache (RenderCache): Cache of previous renders to check before rendering
+        scene_name (str): Scene class to render; defaults to the first scene found in the code
+        num_segments (int): Number of ranges to split into; defaults to the pool size or CPU count
+
+    Returns:
+        str: Path to the generated video
+    """
+    cleaned_code = clean_manim_code(code)
+    if scene_name is None:
+        scene_classes = find_scene_classes(cleaned_code)
+        if not scene_classes:
+            print("Error generating video: no Scene subclass found in code")
+            return None
+        scene_name = scene_classes[0]
+
+    if num_segments is None:
+        num_segments = pool.size if pool is not None else os.cpu_count() or 1
+
+    num_animations = count_scene_animations(cleaned_code, scene_name)
+    if num_animations is None or num_segments < 2 or num_animations < 4:
+        return generate_video_from_code(code, output_dir, quality, pool, cache, scene_name)
+
+    os.makedirs(output_dir, exist_ok=True)
+    job_id = _new_job_id()
+    temp_file = f"temp_animation_{job_id}.py"
+    output_file = os.path.join(output_dir, f"animation_{job_id}.mp4")
+
+    cache_key = cache.key(cleaned_code, scene_name, quality) if cache else None
+    cached_video = cache.get(cache_key) if cache else None
+    if cached_video:
+        _link_or_copy(cached_video, output_file)
+        print(f"Video served from cache: {output_file}")
+        return output_file
+
+    segment_dir = tempfile.mkdtemp(prefix=f"segments_{job_id}_", dir=output_dir)
+    try:
+        with open(temp_file, "w") as f:
+            f.write(cleaned_code)
+
+        segments = plan_animation_segments(num_animations, num_segments)
+        segment_files = [os.path.join(segment_dir, f"segment_{i:03d}.mp4") for i in range(len(segments))]
+
+        with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+            rendered = list(executor.map(
+                lambda job: _render_uncached(temp_file, scene_name, job[1], quality, pool, job[0]),
+                zip(segments, segment_files)
+            ))
+
+        if not all(path and os.path.exists(path) and os.path.getsize(path) > 0 for path in rendered):
+            print("A segment failed or rendered nothing; rendering the scene in a single process")
+            return generate_video_from_code(code, output_dir, quality, pool, cache, scene_name)
+
+        video_path = concat_videos(segment_files, output_file)
+        if video_path:
+            print(f"Video generated successfully: {video_path} ({len(segments)} segments)")
+            if cache:
+                cache.put(cache_key, video_path)
+        return video_path
+
     finally:
-        # Clean up temporary file
         if os.path.exists(temp_file):
             os.remove(temp_file)
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+# Renders that run behind a preview (threads only wait on manim or the warm pool)
+_background_renders = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="background-render")
+
+class RenderHandle:
+    """
+    Handle to a render running in the background.
+
+    Poll it with done(), block on result(), or `await` it from asyncio code. A
+    handle created with start=False doesn't render until start() is called, so
+    callers can cancel() it without ever paying for the render.
+    """
+
+    def __init__(self, render, *args, start: bool = True):
+        self._render = render
+        self._args = args
+        self._future = None
+        self._cancelled = False
+        self._lock = threading.Lock()
+        if start:
+            self.start()
+
+    def start(self) -> "RenderHandle":
+        """Submit the render if it hasn't been started (or cancelled) yet."""
+        with self._lock:
+            if self._future is None and not self._cancelled:
+                self._future = _background_renders.submit(self._render, *self._args)
+        return self
+
+    def done(self) -> bool:
+        """Whether the render has finished (or was cancelled)."""
+        if self._cancelled:
+            return True
+        return self._future is not None and self._future.done()
+
+    def result(self, timeout: float = None) -> str:
+        """
+        Wait for the render, starting it first if needed.
+
+        Returns:
+            str: Path to the generated video, or None if it failed or was cancelled
+        """
+        self.start()
+        if self._cancelled:
+            return None
+        return self._future.result(timeout)
+
+    def cancel(self) -> bool:
+        """Cancel the render if it hasn't begun. Returns whether it was cancelled."""
+        with self._lock:
+            if self._future is None or self._future.cancel():
+                self._cancelled = True
+        return self._cancelled
+
+    def __await__(self):
+        self.start()
+        if self._cancelled:
+            return None
+        return (yield from asyncio.wrap_future(self._future).__await__())
+
+def generate_video_progressive(code: str, output_dir: str = "videos", pool: RenderPool = None,
+                               cache: RenderCache = None, scene_name: str = None, preview_quality: str = "l",
+                               final_quality: str = "h", start_final: bool = True) -> Tuple[str, RenderHandle]:
+    """
+    Render a fast low-quality preview, then the final video in the background.
+
+    Args:
+        code (str): The Manim code to render
+        output_dir (str): Directory to save the videos
+        pool (RenderPool): Warm worker pool to render on instead of spawning the manim CLI
+        cache (RenderCache): Cache of previous renders to check before rendering
+        scene_name (str): Scene class to render; defaults to the first scene found in the code
+        preview_quality (str): Manim quality flag for the preview
+        final_quality (str): Manim quality flag for the final render
+        start_final (bool): Start the final render right away; if False it waits for handle.start()
+
+    Returns:
+        Tuple[str, RenderHandle]: Preview video path and a handle to the final render,
+            or (None, None) if the preview failed
+    """
+    preview_path = generate_video_from_code(code, output_dir, preview_quality, pool, cache, scene_name)
+    if preview_path is None:
+        # The final render would fail the same way, so don't spend it
+        return None, None
+
+    final_render = RenderHandle(
+        generate_video_from_code, code, output_dir, final_quality, pool, cache, scene_name,
+        start=start_final
+    )
+    return preview_path, final_render
+
+def _probe_duration(video_file: str) -> float:
+    """Return a video's duration in seconds using ffprobe."""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=nw=1:nk=1", video_file],
+        capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip())
+
+def _write_hls_playlist(playlist_file: str, segments: List[Tuple[str, float]], finished: bool):
+    """Atomically rewrite an HLS EVENT playlist listing (segment file, duration) pairs."""
+    target_duration = max([math.ceil(duration) for _, duration in segments] + [1])
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        "#EXT-X-PLAYLIST-TYPE:EVENT",
+        f"#EXT-X-TARGETDURATION:{target_duration}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+    ]
+    for segment_file, duration in segments:
+        lines += [f"#EXTINF:{duration:.3f},", segment_file]
+    if finished:
+        lines.append("#EXT-X-ENDLIST")
+
+    temp_file = f"{playlist_file}.tmp"
+    with open(temp_file, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temp_file, playlist_file)
+
+def _stream_render(scene_file: str, scene_name: str, stream_dir: str, quality: str, poll_interval: float) -> str:
+    """
+    Run manim and turn each finished partial movie into an HLS segment as it appears.
+
+    Returns:
+        str: Path to the finished playlist, or None if rendering failed
+    """
+    playlist_file = os.path.join(stream_dir, "playlist.m3u8")
+    media_dir = tempfile.mkdtemp(prefix="manim_media_")
+    segments = []
+    published = 0
+    offset = 0.0
+
+    def publish(partial_files: List[str]):
+        nonlocal published, offset
+        for partial_file in partial_files[published:]:
+            segment_name = f"segment_{published:05d}.ts"
+            duration = _probe_duration(partial_file)
+            # Remux (no re-encode) to MPEG-TS, shifting timestamps so segments play back to back
+            subprocess.run([
+                "ffmpeg", "-y", "-loglevel", "error", "-i", partial_file,
+                "-c", "copy", "-output_ts_offset", f"{offset:.6f}", "-f", "mpegts",
+                os.path.join(stream_dir, segment_name)
+            ], check=True)
+            segments.append((segment_name, duration))
+            offset += duration
+            published += 1
+            _write_hls_playlist(playlist_file, segments, finished=False)
+
+    try:
+        with get_shared_tex_cache().scratch(scene_file_strings(scene_file)) as tex_dirs:
+            config_file = write_manim_config(dict(tex_dirs, media_dir=media_dir),
+                                             os.path.join(media_dir, "manim.cfg"))
+            command = [
+                "manim",
+                f"-q{quality}",  # Render quality
+                "--disable_caching",  # Partial movies are then named uncached_00000.mp4, ... in play order
+                "--config_file", config_file,
+                scene_file,
+                scene_name
+            ]
+
+            log_file = os.path.join(media_dir, "manim.log")
+            with open(log_file, "w") as log:
+                process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+                partial_pattern = os.path.join(
+                    media_dir, "videos", "*", "*", "partial_movie_files", scene_name, "uncached_*.mp4"
+                )
+                while process.poll() is None:
+                    # A partial movie is complete once manim has started writing the next one
+                    publish(sorted(glob.glob(partial_pattern))[:-1])
+                    time.sleep(poll_interval)
+
+        if process.returncode != 0:
+            with open(log_file) as log:
+                print(f"Error generating video: manim exited with status {process.returncode}\n{log.read()[-2000:]}")
+            _write_hls_playlist(playlist_file, segments, finished=True)
+            return None
+
+        publish(sorted(glob.glob(partial_pattern)))
+        _write_hls_playlist(playlist_file, segments, finished=True)
+
+        # Keep the combined movie next to the stream for clients that want a single file
+        for movie_file in glob.glob(os.path.join(media_dir, "videos", "*", "*", f"{scene_name}.mp4")):
+            shutil.move(movie_file, os.path.join(stream_dir, f"{scene_name}.mp4"))
+
+        print(f"Stream finished: {playlist_file} ({len(segments)} segments)")
+        return playlist_file
+
+    except subprocess.CalledProcessError as e:
+        print(f"Error streaming video: {e}")
+        _write_hls_playlist(playlist_file, segments, finished=True)
+        return None
+
+    finally:
+        if os.path.exists(scene_file):
+            os.remove(scene_file)
+        shutil.rmtree(media_dir, ignore_errors=True)
+
+def stream_video_from_code(code: str, output_dir: str = "streams", quality: str = "l", scene_name: str = None,
+                           poll_interval: float = 0.25) -> Tuple[str, RenderHandle]:
+    """
+    Render a scene as an HLS stream with one segment per completed animation.
+
+    The playlist is written immediately and updated as animations finish, so it
+    can be played from any static file server (e.g. `python -m http.server`)
+    while later animations are still rendering.
+
+    Args:
+        code (str): The Manim code to render
+        output_dir (str): Directory to create the stream directory in
+        quality (str): Manim quality flag ("l", "m", "h", "p" or "k")
+        scene_name (str): Scene class to render; defaults to the first scene found in the code
+        poll_interval (float): Seconds between checks for newly finished animations
+
+    Returns:
+        Tuple[str, RenderHandle]: Playlist path and a handle resolving to it once the
+            render ends (None on failure), or (None, None) if the code has no scene
+    """
+    cleaned_code = clean_manim_code(code)
+    if scene_name is None:
+        scene_classes = find_scene_classes(cleaned_code)
+        if not scene_classes:
+            print("Error generating video: no Scene subclass found in code")
+            return None, None
+        scene_name = scene_classes[0]
+
+    job_id = _new_job_id()
+    stream_dir = os.path.join(output_dir, f"stream_{job_id}")
+    os.makedirs(stream_dir, exist_ok=True)
+    playlist_file = os.path.join(stream_dir, "playlist.m3u8")
+    _write_hls_playlist(playlist_file, [], finished=False)
+
+    # The background render owns the scene file and removes it when done
+    scene_file = os.path.abspath(f"temp_animation_{job_id}.py")
+    with open(scene_file, "w") as f:
+        f.write(cleaned_code)
+
+    handle = RenderHandle(_stream_render, scene_file, scene_name, stream_dir, quality, poll_interval)
+    return playlist_file, handle
+
+# Where prewarming looks for tex strings by default: training data and saved eval responses
+PREWARM_SOURCES = [
+    "dataset/data/*.json",
+    "evaluation_results_*.json",
+    "metrics/evaluation_results_*.json",
+    "responses/*.txt",
+]
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["prewarm"]:
+        # python video_generator.py prewarm [--top N] [paths ...]
+        import argparse
+
+        parser = argparse.ArgumentParser(description="Compile common MathTex/Tex strings into the shared tex cache")
+        parser.add_argument("paths", nargs="*", help="Dataset JSON files or responses (defaults to PREWARM_SOURCES)")
+        parser.add_argument("--top", type=int, default=500, help="Number of most common strings to compile")
+        args = parser.parse_args(sys.argv[2:])
+
+        paths = args.paths or [path for pattern in PREWARM_SOURCES for path in sorted(glob.glob(pattern))]
+        prewarm_tex_cache(paths, top_n=args.top)
+        sys.exit(0)
+
     # Example usage
     sample_code = """
 from manim import *
@@ -75,7 +1704,38 @@ class TransformerArchitecture(Scene):
         self.play(Write(title))
         self.wait(2)
 """
-    
-    video_path = generate_video_from_code(sample_code)
+
+    video_path, timings = generate_video_from_code(sample_code, return_timings=True)
     if video_path:
-        print(f"Video saved at: {video_path}") 
\ No newline at end of file
+        print(f"Video saved at: {video_path}")
+        print("Render stages: " + ", ".join(f"{stage}={timings[stage]:.2f}s" for stage in RENDER_STAGES))
+
+    # Reusing a warm pool amortizes manim's startup across renders
+    with RenderPool(size=2) as pool:
+        for _ in range(2):
+            video_path = generate_video_from_code(sample_code, pool=pool)
+            if video_path:
+                print(f"Video saved at: {video_path}")
+
+        # Files with several scenes render them side by side
+        multi_scene_code = sample_code + """
+class TransformerTitleCard(TransformerArchitecture):
+    def construct(self):
+        self.play(FadeIn(Text("Attention Is All You Need")))
+"""
+        for scene_name, video_path in generate_videos_for_scenes(multi_scene_code, pool=pool).items():
+            print(f"{scene_name}: {video_path}")
+
+        # Show a low-quality preview first and let the high-quality render finish behind it
+        preview_path, final_render = generate_video_progressive(sample_code, pool=pool)
+        if preview_path:
+            print(f"Preview ready at: {preview_path}")
+            print(f"Final video saved at: {final_render.result()}")
+
+    # Serve with `python -m http.server` and open streams/stream_*/playlist.m3u8 while it renders
+    playlist_file, stream = stream_video_from_code(sample_code)
+    if playlist_file:
+        print(f"Streaming to: {playlist_file}")
+        stream.result()
+
+    render_timing_histogram.dump_json("render_timings.json")